@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from typing import List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+import toml
+
+import main
+
+# Amino acids the synthetic proteins are made of, and the residues the phospho regex localizes modifications on
+AMINO_ACIDS: str = "ACDEFGHIKLMNPQRSTVWY"
+MODIFIABLE_RESIDUES: str = "STY"
+
+# The stages of main() that are timed, in the order they run
+STAGES: List[str] = ["ingest", "gen_raw_sequences", "fileid_conversion", "protein_index", "localization",
+                     "residue_math", "peptide_math", "output"]
+
+# The input layouts benchmarked: abundance columns, or a fileID column with one abundance column
+MODES: List[str] = ["abundance", "fileid"]
+
+# Regex configuration used for the benchmark, the one shipped in data/
+REGEX_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parser_regex.toml")
+
+
+def generate_proteome(rng: np.random.Generator, n_proteins: int, mean_length: int) -> List[Tuple[str, str]]:
+    """
+    Generates random protein sequences
+    :param rng: the random generator to draw from
+    :param n_proteins: the number of proteins
+    :param mean_length: the mean protein length, lengths are drawn uniformly from half to one and a half times this
+    :return: a list of the (fasta ID, sequence) of each protein
+    """
+    lengths = rng.integers(max(mean_length // 2, 30), max(mean_length * 3 // 2, 31), size=n_proteins)
+    residues = np.array(list(AMINO_ACIDS))
+    return [("sp|SYN{0:06d}|SYN{0:06d}_SYNTH".format(i), ''.join(rng.choice(residues, size=length)))
+            for i, length in enumerate(lengths)]
+
+
+def write_fasta(proteome: List[Tuple[str, str]], path: str):
+    """
+    Writes a proteome generated by generate_proteome as a fasta file
+    """
+    with open(path, 'w') as outfile:
+        for fasta_id, sequence in proteome:
+            outfile.write(">" + fasta_id + "\n")
+            for start in range(0, len(sequence), 60):
+                outfile.write(sequence[start:start + 60] + "\n")
+
+
+def generate_psms(rng: np.random.Generator, proteome: List[Tuple[str, str]], n_rows: int, n_peptides: int,
+                  n_channels: int, mod_density: float, missing_abundance: float, n_fileids: int = 0,
+                  fileid_layout: str = "interleaved") -> pd.DataFrame:
+    """
+    Generates a PSM export in the format of the files in tests/. The rows are drawn from a pool of peptides cut out of
+    the proteome, each with its own modification, so peptides repeat across rows like they do in real exports
+    :param rng: the random generator to draw from
+    :param proteome: the proteins to cut the peptides from, as generated by generate_proteome
+    :param n_rows: the number of rows (PSMs)
+    :param n_peptides: the number of distinct peptides in the pool
+    :param n_channels: the number of "Abundance :F<n>" columns, ignored when n_fileids is given
+    :param mod_density: the probability of each S, T or Y of a peptide being modified
+    :param missing_abundance: the fraction of abundances that are missing
+    :param n_fileids: the number of fileIDs to spread the rows over in a "File ID:" column with a single abundance
+    column, 0 for abundance column layout
+    :param fileid_layout: "interleaved" to assign the fileIDs at random, "blocked" for the rows of each fileID to be
+    consecutive
+    :return: the DataFrame of the export
+    """
+    protein_nums = rng.integers(0, len(proteome), size=n_peptides)
+    peptide_lens = rng.integers(7, 26, size=n_peptides)
+    annotated_sequences = []
+    modifications = []
+    master_modifications = []
+    accessions = []
+    master_positions = []
+    for protein_num, peptide_len in zip(protein_nums, peptide_lens):
+        fasta_id, sequence = proteome[protein_num]
+        peptide_len = min(peptide_len, len(sequence))
+        start = int(rng.integers(0, len(sequence) - peptide_len + 1))
+        peptide = sequence[start:start + peptide_len]
+        before = sequence[start - 1] if start > 0 else "-"
+        after = sequence[start + peptide_len] if start + peptide_len < len(sequence) else "-"
+        annotated_sequences.append("[{}].{}.[{}]".format(before, peptide, after))
+        accession = fasta_id.split("|")[1]
+        accessions.append(accession)
+        master_positions.append("{} [{}-{}]".format(accession, start + 1, start + peptide_len))
+        # one indexed positions of the modified residues in the peptide
+        sites = [i + 1 for i, residue in enumerate(peptide)
+                 if residue in MODIFIABLE_RESIDUES and rng.random() < mod_density]
+        if sites:
+            modifications.append("{}xPhospho [{}]".format(
+                len(sites), "; ".join(peptide[site - 1] + str(site) for site in sites)))
+            master_modifications.append("{} {}xPhospho [{}]".format(
+                accession, len(sites), "; ".join(peptide[site - 1] + str(start + site) for site in sites)))
+        else:
+            modifications.append(np.nan)
+            master_modifications.append(np.nan)
+
+    peptide_rows = rng.integers(0, n_peptides, size=n_rows)
+    psms = pd.DataFrame({
+        "Confidence": "High",
+        "Annotated Sequence": np.array(annotated_sequences, dtype=object)[peptide_rows],
+        "Modifications": np.array(modifications, dtype=object)[peptide_rows],
+        "Modifications in Master Proteins": np.array(master_modifications, dtype=object)[peptide_rows],
+        "# Protein Groups": 1,
+        "# PSMs": rng.integers(1, 6, size=n_rows),
+        "Master Protein Accessions": np.array(accessions, dtype=object)[peptide_rows],
+        "Positions in Master Proteins": np.array(master_positions, dtype=object)[peptide_rows],
+        "# Missed Cleavages": rng.integers(0, 3, size=n_rows)})
+
+    def abundances():
+        values = rng.lognormal(mean=13, sigma=2, size=n_rows)
+        values[rng.random(n_rows) < missing_abundance] = np.nan
+        return values
+
+    if n_fileids:
+        fileids = rng.integers(1, n_fileids + 1, size=n_rows)
+        if fileid_layout == "blocked":
+            fileids = np.sort(fileids)
+        psms["File ID:"] = np.array(["F{}".format(fileid) for fileid in fileids], dtype=object)
+        psms["Abundance :F1"] = abundances()
+    else:
+        for channel in range(1, n_channels + 1):
+            psms["Abundance :F{}".format(channel)] = abundances()
+    return psms
+
+
+def time_stages(input_file: str, fasta_file: str, output_directory: str, abundance_col_titles: List[str],
+                fileid_col_name: str = None, output_format: str = "csv",
+                multiple_localizations: str = "first") -> Dict[str, float]:
+    """
+    Runs the stages of main() on one input file, timing each
+    :param input_file: path to the input file
+    :param fasta_file: path to the fasta file of the proteins
+    :param output_directory: directory to write the output to
+    :param abundance_col_titles: the abundance column titles, only the first is used with a fileID column
+    :param fileid_col_name: title of the fileID column, None for abundance column layout
+    :param output_format: the output_format of the configuration to write the output in
+    :param multiple_localizations: how the abundance of fragments found more than once is shared
+    :return: a dict of the stage names mapped to their wall time in seconds
+    """
+    timings = {}
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    regex_conf = toml.load(REGEX_FILE)
+    mod_regex = regex_conf['regex']['phosphoregex']
+    protein_seq_records = main.get_protein_sequences([fasta_file])
+
+    ftuple = timed("ingest", main.ingest_file_data, [input_file])[0]
+    ftuple = timed("gen_raw_sequences", main.gen_raw_sequences, ftuple)
+    if fileid_col_name is not None:
+        abundance_col_titles, ftuple = timed(
+            "fileid_conversion", main.convert_fileidtoabundaceformat, ftuple,
+            main.sanitize_str_for_dataframe_index(fileid_col_name), abundance_col_titles[0])
+    else:
+        timings["fileid_conversion"] = 0.0
+    protein_index = timed("protein_index", main.build_protein_index, protein_seq_records)
+    localized_ftuple, mod_loc_col_titles, frag_loc_col_titles = timed(
+        "localization", main.localize_fragments, ftuple, protein_seq_records, mod_regex, protein_index, None,
+        multiple_localizations)
+    residue_analysis = timed("residue_math", main.calc_residue_mod_abundances, localized_ftuple, mod_loc_col_titles,
+                             frag_loc_col_titles, abundance_col_titles, protein_seq_records)
+    peptide_analysis = timed("peptide_math", main.calc_peptide_mod_abundances, localized_ftuple, mod_loc_col_titles,
+                             frag_loc_col_titles, abundance_col_titles, protein_seq_records)
+
+    def output():
+        if output_format != "csv":
+            main.output_analysis_tables([input_file], [residue_analysis], [peptide_analysis], output_directory,
+                                        "residueModificationAnalysis", "peptideModificationAnalysis", output_format)
+            return
+        for prot_id, sample_analysis in residue_analysis.items():
+            for file_id, abundance_array in sample_analysis.items():
+                main.output_residue_analysis_data(prot_id, file_id, abundance_array, output_directory,
+                                                  "residueModificationAnalysis")
+        for file_id, prot_analysis in peptide_analysis.items():
+            for prot_id, fragment_list in prot_analysis.items():
+                main.output_peptide_analysis_data(prot_id, file_id, fragment_list, output_directory,
+                                                  "peptideModificationAnalysis")
+    timed("output", output)
+    return timings
+
+
+def time_main(input_file: str, fasta_file: str, output_directory: str, abundance_col_titles: List[str],
+              fileid_col_name: str = None, jobs: int = None, output_format: str = "csv",
+              multiple_localizations: str = "first") -> float:
+    """
+    Runs main() end to end on one input file through a generated configuration
+    :return: the wall time of main() in seconds
+    """
+    configuration = {
+        'input': {'input_files': [input_file], 'prot_seq_fasta': [fasta_file]},
+        'output': {'output_directory': output_directory,
+                   'residue_output_name_stub': "residueModificationAnalysis",
+                   'peptide_output_name_stub': "peptideModificationAnalysis",
+                   'output_format': output_format},
+        'parser_config': {'using_fileID_column': fileid_col_name is not None,
+                          'fileid_col_name': fileid_col_name or "",
+                          'abundance_col_titles': abundance_col_titles,
+                          'multiple_localizations': multiple_localizations,
+                          'regex': {'regex_file': REGEX_FILE, 'mod_parsing_regex': "phosphoregex",
+                                    'pos_master_regex': "pos_master_regex"},
+                          'master': {'use': False}}}
+    config_path = os.path.join(output_directory, "benchmark_config.toml")
+    with open(config_path, 'w') as outfile:
+        toml.dump(configuration, outfile)
+    main.config_file = config_path
+    start = time.perf_counter()
+    main.main(jobs=jobs)
+    return time.perf_counter() - start
+
+
+def run_benchmark(args: argparse.Namespace, work_directory: str) -> Dict:
+    """
+    Generates the synthetic data described by the command line arguments and times the pipeline on it in each mode
+    :param args: the parsed command line arguments
+    :param work_directory: directory to write the generated data and outputs to
+    :return: the benchmark results
+    """
+    rng = np.random.default_rng(args.seed)
+    proteome = generate_proteome(rng, args.proteins, args.protein_length)
+    fasta_file = os.path.join(work_directory, "proteome.fasta")
+    write_fasta(proteome, fasta_file)
+    n_peptides = args.peptides or max(args.rows // 10, 1)
+
+    runs = []
+    modes = MODES if args.mode == "both" else [args.mode]
+    for mode in modes:
+        n_fileids = args.fileids if mode == "fileid" else 0
+        # each mode has its own generator so its data doesn't depend on which other modes are run
+        psms = generate_psms(np.random.default_rng([args.seed, MODES.index(mode)]), proteome, args.rows, n_peptides,
+                             args.channels, args.mod_density, args.missing_abundance, n_fileids, args.fileid_layout)
+        input_file = os.path.join(work_directory, "psms_{}.csv".format(mode))
+        psms.to_csv(input_file, index=False)
+        abundance_col_titles = [title for title in psms.columns if title.startswith("Abundance")]
+        fileid_col_name = "File ID:" if mode == "fileid" else None
+
+        samples = {stage: [] for stage in STAGES}
+        end_to_end = []
+        for repeat in range(args.repeat):
+            output_directory = os.path.join(work_directory, "output_{}_{}".format(mode, repeat)) + os.sep
+            os.makedirs(output_directory, exist_ok=True)
+            for stage, seconds in time_stages(input_file, fasta_file, output_directory, abundance_col_titles,
+                                              fileid_col_name, args.output_format,
+                                              args.multiple_localizations).items():
+                samples[stage].append(seconds)
+            if args.end_to_end:
+                shutil.rmtree(output_directory)
+                os.makedirs(output_directory)
+                end_to_end.append(time_main(input_file, fasta_file, output_directory, abundance_col_titles,
+                                            fileid_col_name, args.jobs, args.output_format,
+                                            args.multiple_localizations))
+            shutil.rmtree(output_directory)
+
+        runs.append({'mode': mode, 'rows': args.rows, 'peptides': n_peptides,
+                     'channels': len(abundance_col_titles) if mode == "abundance" else n_fileids,
+                     # the fastest of the repeats, and every repeat
+                     'stages': {stage: min(seconds) for stage, seconds in samples.items()},
+                     'stage_samples': samples,
+                     'total': sum(min(seconds) for seconds in samples.values()),
+                     'end_to_end': min(end_to_end) if end_to_end else None,
+                     'end_to_end_samples': end_to_end})
+
+    return {'parameters': vars(args),
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'pandas': pd.__version__, 'platform': platform.platform()},
+            'runs': runs}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description="Times each stage of the pipeline on synthetic data generated from a seed")
+    arg_parser.add_argument('--seed', type=int, default=0, help="seed of the data generator")
+    arg_parser.add_argument('--proteins', type=int, default=100, help="number of proteins in the proteome")
+    arg_parser.add_argument('--protein-length', type=int, default=500, help="mean protein length")
+    arg_parser.add_argument('--rows', type=int, default=10000, help="number of PSM rows")
+    arg_parser.add_argument('--peptides', type=int, default=0,
+                            help="number of distinct peptides, defaults to a tenth of the rows")
+    arg_parser.add_argument('--channels', type=int, default=4, help="abundance columns in abundance column mode")
+    arg_parser.add_argument('--fileids', type=int, default=4, help="number of fileIDs in fileID mode")
+    arg_parser.add_argument('--fileid-layout', choices=["interleaved", "blocked"], default="interleaved",
+                            help="whether the rows of each fileID are spread out or consecutive")
+    arg_parser.add_argument('--mod-density', type=float, default=0.2,
+                            help="probability of each S, T or Y of a peptide being modified")
+    arg_parser.add_argument('--missing-abundance', type=float, default=0.05,
+                            help="fraction of abundances that are missing")
+    arg_parser.add_argument('--mode', choices=["abundance", "fileid", "both"], default="both",
+                            help="abundance column layout, fileID column layout or both")
+    arg_parser.add_argument('--repeat', type=int, default=1, help="times to run each mode, the fastest is reported")
+    arg_parser.add_argument('--end-to-end', action='store_true', help="also time main() on the generated data")
+    arg_parser.add_argument('--output-format', choices=["csv", "long_csv", "parquet"], default="csv",
+                            help="layout of the output, a csv per protein and channel or single tables")
+    arg_parser.add_argument('--multiple-localizations', choices=main.MULTIPLE_LOCALIZATIONS, default="first",
+                            help="how the abundance of peptides found more than once in the proteome is shared")
+    arg_parser.add_argument('--jobs', '-j', type=int, default=None, help="worker processes for the end to end run")
+    arg_parser.add_argument('--output', '-o', default=None, help="file to write the JSON results to, else stdout")
+    arg_parser.add_argument('--keep', default=None,
+                            help="directory to keep the generated data in, a temporary directory if not given")
+    args = arg_parser.parse_args()
+
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        results = run_benchmark(args, args.keep)
+    else:
+        with tempfile.TemporaryDirectory() as work_directory:
+            results = run_benchmark(args, work_directory)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -1,45 +1,123 @@
+import argparse
+import bisect
 import csv
+import hashlib
+import importlib
+import json
+import mmap
+import os
+import queue
 import re
+import shutil
+import sys
+import threading
+import time
+import traceback
 from collections import namedtuple
-from typing import List, Tuple, Dict
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import List, Tuple, Dict, Iterator, Pattern, Callable, ContextManager
+
+try:
+    import resource
+except ImportError:  # not available on Windows, where the peak memory of the profile is reported as 0
+    resource = None
 
 import numpy as np
 import pandas as pd
 import toml
-from Bio import SeqRecord, SeqIO
 
 # Path to configuration toml file
 config_file: str = "config.toml"
 
-FileTuple = namedtuple("FileTuple", ['FileName', 'FileData'])
+# Localizations is filled in by the localizers with the ProteinLocalization of the FileData rows in each protein,
+# keyed by proteinID. Channels is the ChannelMatrix of the FileData rows when its abundance channels come from a fileID
+# column, None when they are abundance columns of the FileData
+FileTuple = namedtuple("FileTuple", ['FileName', 'FileData', 'Localizations', 'Channels'], defaults=(None, None))
+
+# ChannelMatrix holds abundance channels where each row of a DataFrame has an abundance in one channel only, without a
+# mostly NaN column per channel. Row i has the abundance Abundances[i] in the channel titled Titles[RowChannels[i]], and
+# is missing (NaN) in every other channel
+ChannelMatrix = namedtuple("ChannelMatrix", ['Titles', 'RowChannels', 'Abundances'])
+
+# ProteinLocalization holds where the fragments of an input file are in one protein as flat arrays instead of a list
+# per row. Rows are the ascending positions in the DataFrame of the fragments found in the protein, every other row is
+# missing from the protein. For the fragment in row Rows[i], FragStarts and FragEnds[FragOffsets[i]:FragOffsets[i + 1]]
+# are the one indexed, inclusive start and end of each of its occurrences in the protein, first occurrence first, and
+# ModPositions[ModOffsets[i]:ModOffsets[i + 1]] are the one indexed positions of its modifications in the protein,
+# relative to its first occurrence. FragWeights is None when only the first occurrence of each fragment gets its
+# abundance, otherwise the share of the abundance that goes to each occurrence, whose modifications are at the same
+# offsets from its start as from the start of the first occurrence. ModWeights is the site probability of each
+# modification, None when every modification is certain
+ProteinLocalization = namedtuple("ProteinLocalization", ['Rows', 'FragOffsets', 'FragStarts', 'FragEnds',
+                                                         'ModOffsets', 'ModPositions', 'FragWeights', 'ModWeights'],
+                                 defaults=(None, None))
+
+# How the abundance of a fragment found at more than one location is shared: only the first location in each protein
+# gets it, every location in each protein gets an even share of it, or every location in every protein gets an even
+# share of it
+MULTIPLE_LOCALIZATIONS: Tuple[str, ...] = ('first', 'protein', 'all')
+
+# ProteinIndex is a suffix array over the concatenation of every protein sequence, separated by PROTEIN_SEPARATOR.
+# Sequence holds the concatenated, uppercased sequences as bytes, SuffixArray the start of each suffix in sorted
+# order, ProteinIDs the ID of each protein in concatenation order, and ProteinOffsets the start of each protein in
+# Sequence
+ProteinIndex = namedtuple("ProteinIndex", ['Sequence', 'SuffixArray', 'ProteinIDs', 'ProteinOffsets'])
+
+# Placed between proteins in the ProteinIndex so no peptide can match across two proteins
+PROTEIN_SEPARATOR: bytes = b'\x00'
+
+# Bumped whenever the way FASTA stores are saved changes, so stores of older versions are rebuilt
+PROTEIN_STORE_VERSION: int = 1
 
 
 def convert_fileidtoabundaceformat(ftuple, fileid_col_name, abundance_col_name):
+    """
+    Splits the abundance column into one abundance channel per fileID in a single pass. The rows are put in fileID
+    order, keeping their order within each fileID, and rows without a fileID are dropped. The channels are kept as a
+    ChannelMatrix instead of adding a column per fileID that is NaN for the rows of every other fileID
+    :param ftuple: FileTuple containing the DataFrame with the fileID and abundance columns
+    :param fileid_col_name: sanitized title of the fileID column
+    :param abundance_col_name: title of the abundance column
+    :return: a tuple of the channel titles, in fileID order, and the FileTuple with the ChannelMatrix of its rows
+    """
     file_data = ftuple.FileData
-    grouped = file_data.groupby(fileid_col_name)
-    # for every row with the same fileID
-    outputdf = pd.DataFrame()
-    abundance_col_titles = []
-    for fileidgroup in grouped:
-        # create a new DataFrame with a new abundance id title and copy the abundances over
-        current_fileid = fileidgroup[0]
-        data_same_fileid = fileidgroup[1]
-        colname = sanitize_str_for_dataframe_index("Abundance:" + current_fileid)
-        abundance_col_titles.append(colname)
-        current_abundances = data_same_fileid[sanitize_str_for_dataframe_index(abundance_col_name)].tolist()
-        data_same_fileid = data_same_fileid.assign(**{colname: current_abundances})
-        # frag_by_fileid.append(data_same_fileid)
-        outputdf = pd.concat([outputdf, data_same_fileid], sort=True)
-    return abundance_col_titles, FileTuple(FileName=ftuple[0], FileData=outputdf)
-
-
-def main():
+    # the rows of every fileID, fileID by fileID
+    codes, fileids = pd.factorize(file_data[fileid_col_name], sort=True)
+    rows = np.argsort(codes, kind='stable')[np.count_nonzero(codes == -1):]
+    abundance_col_titles = [sanitize_str_for_dataframe_index("Abundance:" + str(fileid)) for fileid in fileids]
+    file_data = file_data.take(rows)
+    channels = ChannelMatrix(Titles=abundance_col_titles, RowChannels=codes[rows].astype(np.int32),
+                             Abundances=file_data[sanitize_str_for_dataframe_index(abundance_col_name)].to_numpy(
+                                 dtype=float))
+    return abundance_col_titles, FileTuple(FileName=ftuple[0], FileData=file_data, Channels=channels)
+
+
+def main(jobs: int = None, profile_report: str = None, metrics_hook: Callable[[str, Dict], None] = None,
+         configuration: dict = None):
+    """
+    Runs the analysis described by config_file, or by the given configuration
+    :param jobs: the number of worker processes to use, overrides the workers setting of the configuration
+    :param profile_report: path of the JSON file to write a PipelineProfile of the run to, empty for the report setting
+    of the configuration. Profiles the run even if the profile section of the configuration doesn't
+    :param metrics_hook: called with the name and measurements of each stage as it finishes, profiles the run and is
+    used in place of the metrics_hook of the configuration
+    :param configuration: the parsed configuration to run, read from config_file when not given
+    """
     # Get the desired configuration-------------------------------------------------------------------------------------
-    configuration: dict = toml.load(config_file)
+    if configuration is None:
+        configuration = toml.load(config_file)
 
     # I/O files
     input_file = configuration['input']["input_files"]
     protein_fasta_files: List[str] = configuration['input']['prot_seq_fasta']
+    # Directory of FASTA stores, the indexed protein sequences of the FASTA files built by the first run and memory
+    # mapped by later ones. Empty to read and index the FASTA files every run
+    fasta_store_directory: str = configuration['input'].get('fasta_store_directory', '')
     residue_output_name_stub = configuration['output']['residue_output_name_stub']
     output_directory = configuration['output']['output_directory']
 
@@ -47,13 +125,18 @@ def main():
     regex_conf = toml.load(configuration['parser_config']['regex']['regex_file'])
     mod_parsing_regex_to_use = configuration['parser_config']['regex']['mod_parsing_regex']
     mod_regex = regex_conf['regex'][mod_parsing_regex_to_use]
+    compile_regex(mod_regex)  # compiled once up front so a bad pattern is reported before any data is read
 
     # config if using the pre-provided master localizations
     use_mod_in_master_prot: bool = configuration['parser_config']['master']['use']
     if use_mod_in_master_prot:  # put this behind conditional so if master parsing isn't desired it won't complain if
         # the config file isn't completely correct/filled out with regards to the master protein parsing settings
-        master_prot_name: bool = configuration['parser_config']['master']['master_protein_name']
+        master_prot_name: str = configuration['parser_config']['master']['master_protein_name']
         master_protein_fasta_id = configuration['parser_config']['master']['master_protein_fasta_ID']
+        # the name in the data of each master protein mapped to its fasta ID
+        master_proteins: Dict[str, str] = {master_prot_name: master_protein_fasta_id,
+                                           **configuration['parser_config']['master'].get('additional_master_proteins',
+                                                                                          {})}
         master_regex_to_use = configuration['parser_config']['regex']['pos_master_regex']
         master_regex = regex_conf['regex'][master_regex_to_use]
     # Config for parsing and analyzing the data
@@ -64,91 +147,599 @@ def main():
     using_file_id_column = configuration['parser_config']['using_fileID_column']
     if using_file_id_column:
         fileid_col_name = configuration['parser_config']['fileid_col_name']
+    # How the abundance of a fragment found at more than one location is shared between the locations
+    multiple_localizations: str = configuration['parser_config'].get('multiple_localizations', 'first')
+    if multiple_localizations not in MULTIPLE_LOCALIZATIONS:
+        raise ValueError("Unsupported multiple_localizations {}, expected one of {}".format(
+            multiple_localizations, ", ".join(MULTIPLE_LOCALIZATIONS)))
     should_calculate_peptide_modifications = True  # configuration['parser_config']['calculate_peptide_modifications']
     if should_calculate_peptide_modifications:
         peptide_output_name_stub = configuration['output']['peptide_output_name_stub']
 
+    # Localized DataFrames saved by an earlier run, loaded in place of reading and localizing the input files
+    localized_files: List[str] = configuration['input'].get('localized_files', [])
+    # "csv" writes a csv per protein and abundance column, "long_csv" and "parquet" one residue and one peptide table
+    output_format: str = configuration['output'].get('output_format', 'csv')
+    # Compression of the long_csv or parquet tables, empty for uncompressed CSV or the Parquet default
+    output_compression: str = configuration['output'].get('compression', '')
+    # Whether to save each localized DataFrame to the output directory so later runs can load it
+    save_localization: bool = configuration['output'].get('save_localization', False)
+
+    # Directory of the localization cache, empty to not cache localizations, and the size the cache is kept under
+    cache_directory: str = configuration.get('cache', {}).get('directory', '')
+    cache_max_size: int = int(configuration.get('cache', {}).get('max_size_mb', 1024) * 1024 * 1024)
+
+    # Directory of the incremental state of the analysis of each input file, empty to analyze every input file
+    state_directory: str = configuration.get('incremental', {}).get('state_directory', '')
+
+    # Rows of each input file to read, localize and accumulate at a time. 0 reads each file whole
+    chunk_size: int = configuration.get('execution', {}).get('chunk_size', 0)
+    # Number of processes to spread localization and abundance calculation over, the jobs argument takes precedence
+    workers: int = jobs if jobs is not None else configuration.get('execution', {}).get('workers', 1)
+    # Input files (or chunks) to read ahead and analyses to write behind the input file being analyzed, when analyzing
+    # one input file at a time in this process. 0 runs each stage for every input file before the next stage
+    pipeline_depth: int = configuration.get('execution', {}).get('pipeline_depth', 0)
+
+    # Profiling of the stages of the run, written as a JSON report and optionally forwarded to a metrics hook
+    profile_conf: dict = configuration.get('profile', {})
+    if metrics_hook is None and profile_conf.get('metrics_hook'):
+        metrics_hook = load_metrics_hook(profile_conf['metrics_hook'])
+    if profile_report is None and (profile_conf.get('enabled', False) or metrics_hook is not None):
+        profile_report = profile_conf.get('report', '')
+    if profile_report == '':
+        profile_report = os.path.join(output_directory, 'profile.json')
+    profile = PipelineProfile(metrics_hook) if profile_report is not None else None
+
     # End of configuration reading--------------------------------------------------------------------------------------
 
-    # Read input files--------------------------------------------------------------------------------------------------
-    # input_data is a list of FileTuples (filename, pandas DataFrame of the csv)
-    input_data: List[FileTuple] = ingest_file_data(files=input_file)
-    protein_seq_records: Dict = get_protein_sequences(protein_fasta_files)
-    # End of Data file reading------------------------------------------------------------------------------------------
+    with profile_stage(profile, 'read_fasta', files=len(protein_fasta_files)) as counts:
+        protein_seq_records: ProteinSequences = read_protein_sequences(protein_fasta_files, fasta_store_directory)
+        counts['proteins'] = len(protein_seq_records)
+    master_localization = (master_proteins, master_regex) if use_mod_in_master_prot else None
+
+    # Incremental state: input files analyzed by an earlier run with the same input, FASTA files and analysis settings
+    # have their residue and peptide analyses loaded, only the other input files are analyzed
+    all_input_files: List[str] = input_file
+    state_keys: List[str] = []
+    stored_analyses: Dict[int, Tuple[Dict, Dict]] = {}
+    if state_directory and not localized_files:
+        with profile_stage(profile, 'state_lookup', files=len(input_file)) as counts:
+            analysis_settings = {'mod_regex': mod_regex, 'master_localization': master_localization,
+                                 'multiple_localizations': multiple_localizations,
+                                 'fileid': fileid_col_name if using_file_id_column else None,
+                                 'abundance_col_titles': abundance_col_titles,
+                                 'calculate_peptides': should_calculate_peptide_modifications}
+            fasta_digests = [file_digest(fasta_file) for fasta_file in protein_fasta_files]
+            for i, input_file_path in enumerate(input_file):
+                state_keys.append(localization_cache_key(input_file_path, fasta_digests, analysis_settings,
+                                                         ANALYSIS_STATE_VERSION))
+                stored_analysis = load_analysis_state(state_directory, state_keys[i])
+                if stored_analysis is not None:
+                    stored_analyses[i] = stored_analysis
+            counts['stored_files'] = len(stored_analyses)
+        input_file = [input_file_path for i, input_file_path in enumerate(all_input_files) if i not in stored_analyses]
+
+    # index the proteins once so every input file can be localized against the same index. Only built up front when
+    # every input file will be localized, the in-memory path builds it once it knows some input isn't cached
+    protein_index: ProteinIndex = None
+    if not (use_mod_in_master_prot or localized_files or not input_file or not chunk_size and cache_directory):
+        with profile_stage(profile, 'protein_index', proteins=len(protein_seq_records)):
+            protein_index = build_protein_index(protein_seq_records)
 
-    # get the sequence from the without the cleavage annotations, etc. from the annotated sequence column
-    data = (gen_raw_sequences(ftuple) for ftuple in input_data)
-    if using_file_id_column:
-        new_abundance_col_titles = []
-        reformatted_data = []
-        for ftuple in data:
-            tup = convert_fileidtoabundaceformat(ftuple, sanitize_str_for_dataframe_index(fileid_col_name),
-                                                 abundance_col_titles[0])
-            new_abundance_col_titles.extend(tup[0])
-            reformatted_data.append(tup[1])
-        abundance_col_titles = new_abundance_col_titles
-        data = reformatted_data
-    # Dicts to store the indices for the data generated by localizing the fragments and modifications
-    modification_localization_col_titles: Dict[str, str] = dict()  # Dict containing {proteinID: column title}
-    frag_localization_col_titles: Dict[str, str] = dict()  # Dict containing {proteinID: column title}
-
-    # list that will contain the FileTuples after the fragments contained have been localized
-    localized_data: List[FileTuple] = []  # contains the FileTuples once they have been localized against input proteins
-
-    # Localization of fragments and modifications-----------------------------------------------------------------------
-    # todo modify data in place instead of returning the modified copy?
-    # todo use generator here instead of loop?
-    for ftuple in data:
-        # localizes each fragment within the proteins provided, either via master protein or via the protein fasta files
-        # provided in the configuration
-        if use_mod_in_master_prot:  # localize using the master protein positions and modifications
-            file_headers_tuple: Tuple[FileTuple, Dict[str, str], Dict[str, str]] = \
-                parse_masterlocalizations(ftuple, master_protein_fasta_id, mod_regex, master_regex)
-        else:  # localize by aligning the fragment against a protein and looking at the modification index within the
-            # fragment
-            file_headers_tuple: Tuple[FileTuple, Dict[str, str], Dict[str, str]] = \
-                parse_prot_localizations(ftuple, protein_seq_records, mod_regex)
-
-        # add the data that has been localized to our list and make note of the DataFrame headers containing the
-        # localization
-        localized_data.append(file_headers_tuple[0])  # add the FileTuple to the list of localized FileTuples
-        modification_localization_col_titles.update(file_headers_tuple[1])  # add the list of (proteinID, column
-        # title) tuples
-        frag_localization_col_titles.update(file_headers_tuple[2])  # Dict containing {proteinID: column title}
-    # End of fragment and modification localization---------------------------------------------------------------------
-
-    # Calculate the residue and modification abundances of each input against each desired protein----------------------
     residue_analysis_all_prot: List[Dict[Dict]] = []
     peptide_analysis_all_prot: List[Dict[Dict]] = []
-    for ftuple in localized_data:
-        # for residue modification analysis, calculate the amount each residue is modified
-        residue_analysis_all_prot.append(calc_residue_mod_abundances(ftuple, modification_localization_col_titles,
-                                                                     frag_localization_col_titles, abundance_col_titles,
-                                                                     protein_seq_records))
-        # for peptide modification analysis, calculate the amount each peptide fragment is modified
-        if should_calculate_peptide_modifications:
-            peptide_analysis_all_prot.append(calc_peptide_mod_abundances(ftuple, modification_localization_col_titles,
-                                                                         frag_localization_col_titles,
-                                                                         abundance_col_titles, protein_seq_records))
-    # End of abundance calculations-------------------------------------------------------------------------------------
+    # the file each analysis in residue_analysis_all_prot and peptide_analysis_all_prot came from
+    analysis_files: List[str] = localized_files if localized_files else input_file
+    # whether the analyses were stored and written as they were made, rather than collected to be written at the end
+    analyses_written: bool = False
+    if localized_files:
+        # Skip reading and localizing the input and load the localizations of an earlier run instead
+        with profile_stage(profile, 'load_localized', files=len(localized_files)) as counts:
+            localized_data, modification_localization_col_titles, frag_localization_col_titles, abundance_col_titles = \
+                load_localized_files(localized_files)
+            counts['rows'] = sum(len(ftuple.FileData) for ftuple in localized_data)
+        residue_analysis_all_prot, peptide_analysis_all_prot = calc_localized_abundances(
+            localized_data, modification_localization_col_titles, frag_localization_col_titles,
+            [abundance_col_titles] * len(localized_data), protein_seq_records, should_calculate_peptide_modifications,
+            profile)
+    elif pipeline_depth and workers <= 1 and (chunk_size or state_directory or not using_file_id_column):
+        # Pipelined analysis of one input file at a time: the next input files are read in a reader thread, and the
+        # analyses of the previous ones stored and written in writer threads, while the current one is localized and
+        # calculated. The stages overlap, so they are profiled together
+        cache_keys: Dict[int, str] = {}
+        if cache_directory and not chunk_size:
+            localization_settings = {'mod_regex': mod_regex, 'master_localization': master_localization,
+                                     'multiple_localizations': multiple_localizations,
+                                     'fileid': (fileid_col_name, abundance_col_titles[0])
+                                     if using_file_id_column else None}
+            fasta_digests = [file_digest(fasta_file) for fasta_file in protein_fasta_files]
 
-    # output the abundance data-----------------------------------------------------------------------------------------
-    for prot_residue_analysis in residue_analysis_all_prot:
-        for prot_id, sample_analysis in prot_residue_analysis.items():
-            for file_id, abundance_array in sample_analysis.items():
-                output_residue_analysis_data(prot_id, file_id, abundance_array, output_directory,
-                                             residue_output_name_stub)
+        def read_input(i: int) -> Tuple[FileTuple, List[str], Dict[str, str], Dict[str, str]]:
+            # the FileTuple and abundance columns of the input file, and its localization column titles when it was
+            # loaded localized from the cache. Stored and streamed input files aren't read here
+            if i in stored_analyses or chunk_size:
+                return None
+            if cache_directory:
+                cache_keys[i] = localization_cache_key(all_input_files[i], fasta_digests, localization_settings)
+                cached_path = lookup_localization_cache(cache_directory, cache_keys[i])
+                if cached_path is not None:
+                    loaded = load_localized_files([cached_path])
+                    return loaded[0][0], loaded[3] if using_file_id_column else abundance_col_titles, loaded[1], \
+                        loaded[2]
+            return read_input_file(all_input_files[i], abundance_col_titles,
+                                   fileid_col_name if using_file_id_column else None) + (None, None)
 
-    for prot_peptide_analysis in peptide_analysis_all_prot:
-        for file_id, prot_analysis in prot_peptide_analysis.items():
-            for prot_id, fragment_list in prot_analysis.items():
-                output_peptide_analysis_data(prot_id, file_id, fragment_list, output_directory,
-                                             peptide_output_name_stub)
+        def analyze_input(i: int, contents) -> Tuple[int, Dict, Dict]:
+            nonlocal protein_index
+            if i in stored_analyses:
+                return (i,) + stored_analyses[i]
+            if chunk_size:
+                accumulator = stream_file_analysis(all_input_files[i], chunk_size, protein_seq_records, mod_regex,
+                                                   abundance_col_titles,
+                                                   fileid_col_name if using_file_id_column else None,
+                                                   protein_index, master_localization, prefetch_depth=pipeline_depth,
+                                                   multiple_localizations=multiple_localizations)
+                return i, accumulator.residue_analysis(), \
+                    accumulator.peptide_analysis() if should_calculate_peptide_modifications else None
+            ftuple, ftuple_abundance_col_titles, mod_loc_col_titles, frag_loc_col_titles = contents
+            if mod_loc_col_titles is None:
+                if protein_index is None and master_localization is None:
+                    protein_index = build_protein_index(protein_seq_records)
+                ftuple, mod_loc_col_titles, frag_loc_col_titles = \
+                    localize_fragments(ftuple, protein_seq_records, mod_regex, protein_index, master_localization,
+                                       multiple_localizations)
+                if save_localization:
+                    save_localized_data(ftuple, mod_loc_col_titles, frag_loc_col_titles, ftuple_abundance_col_titles,
+                                        localized_output_path(all_input_files[i], output_directory))
+                if cache_directory:
+                    store_localization_cache(cache_directory, cache_keys[i], ftuple, mod_loc_col_titles,
+                                             frag_loc_col_titles, ftuple_abundance_col_titles,
+                                             max_size=cache_max_size)
+            residue_analyses, peptide_analyses = calc_localized_abundances(
+                [ftuple], mod_loc_col_titles, frag_loc_col_titles, [ftuple_abundance_col_titles], protein_seq_records,
+                should_calculate_peptide_modifications)
+            return i, residue_analyses[0], peptide_analyses[0] if should_calculate_peptide_modifications else None
+
+        def store_states(analyses: Iterator[Tuple[int, Dict, Dict]]):
+            for i, residue_analysis, peptide_analysis in analyses:
+                if i not in stored_analyses:
+                    store_analysis_state(state_directory, state_keys[i], residue_analysis, peptide_analysis)
+
+        def write_residue_table(analyses: Iterator[Tuple[int, Dict, Dict]]):
+            output_analysis_table(output_directory + residue_output_name_stub, residue_analysis_table,
+                                  ((all_input_files[i], analysis) for i, analysis, _ in analyses),
+                                  output_format, output_compression)
+
+        def write_peptide_table(analyses: Iterator[Tuple[int, Dict, Dict]]):
+            output_analysis_table(output_directory + peptide_output_name_stub, peptide_analysis_table,
+                                  ((all_input_files[i], analysis) for i, _, analysis in analyses),
+                                  output_format, output_compression)
+
+        def write_csvs(analyses: Iterator[Tuple[int, Dict, Dict]]):
+            for _, residue_analysis, peptide_analysis in analyses:
+                output_analysis_csvs([residue_analysis], [peptide_analysis] if peptide_analysis is not None else [],
+                                     output_directory, residue_output_name_stub,
+                                     peptide_output_name_stub if should_calculate_peptide_modifications else None)
+
+        writes = [store_states] if state_directory else []
+        if output_format in ('long_csv', 'parquet'):
+            writes.append(write_residue_table)
+            if should_calculate_peptide_modifications:
+                writes.append(write_peptide_table)
+        else:
+            writes.append(write_csvs)
+        with profile_stage(profile, 'pipelined_analysis', files=len(all_input_files)):
+            run_pipeline(iter(range(len(all_input_files))), pipeline_depth, read_input, analyze_input, writes)
+            if state_directory:
+                prune_analysis_state(state_directory, state_keys)
+        analyses_written = True
+    elif chunk_size and workers > 1:
+        # Streaming analysis of each input file in its own worker process. The stages run in the workers, so they are
+        # profiled together, with the CPU time and peak memory of the workers
+        with profile_stage(profile, 'parallel_stream_analysis', files=len(input_file)):
+            for accumulator in parallel_stream_analysis(input_file, workers, chunk_size, protein_seq_records,
+                                                        mod_regex, abundance_col_titles,
+                                                        fileid_col_name if using_file_id_column else None,
+                                                        protein_index, master_localization, multiple_localizations):
+                residue_analysis_all_prot.append(accumulator.residue_analysis())
+                if should_calculate_peptide_modifications:
+                    peptide_analysis_all_prot.append(accumulator.peptide_analysis())
+    elif chunk_size:
+        # Streaming analysis: only one chunk of an input file is held in memory at a time, its results are added to
+        # running residue and peptide abundances for the file
+        for input_file_path in input_file:
+            accumulator = stream_file_analysis(input_file_path, chunk_size, protein_seq_records, mod_regex,
+                                               abundance_col_titles,
+                                               fileid_col_name if using_file_id_column else None,
+                                               protein_index, master_localization, profile,
+                                               multiple_localizations=multiple_localizations)
+            residue_analysis_all_prot.append(accumulator.residue_analysis())
+            if should_calculate_peptide_modifications:
+                peptide_analysis_all_prot.append(accumulator.peptide_analysis())
+    else:
+        # Localization cache: input files localized by an earlier run with the same input, FASTA files and
+        # localization settings are loaded instead of being read and localized again
+        cache_keys: List[str] = [None] * len(input_file)
+        cached_localizations: Dict[int, Tuple[FileTuple, Dict[str, str], Dict[str, str], List[str]]] = {}
+        if cache_directory:
+            with profile_stage(profile, 'cache_lookup', files=len(input_file)) as counts:
+                localization_settings = {'mod_regex': mod_regex, 'master_localization': master_localization,
+                                         'multiple_localizations': multiple_localizations,
+                                         'fileid': (fileid_col_name, abundance_col_titles[0])
+                                         if using_file_id_column else None}
+                fasta_digests = [file_digest(fasta_file) for fasta_file in protein_fasta_files]
+                for i, input_file_path in enumerate(input_file):
+                    cache_keys[i] = localization_cache_key(input_file_path, fasta_digests, localization_settings)
+                    cached_path = lookup_localization_cache(cache_directory, cache_keys[i])
+                    if cached_path is not None:
+                        loaded = load_localized_files([cached_path])
+                        # the cached abundance columns only matter after fileID conversion, otherwise every column
+                        # of the input is in the cached DataFrame and the configured ones are used
+                        cached_localizations[i] = (loaded[0][0], loaded[1], loaded[2],
+                                                   loaded[3] if using_file_id_column else abundance_col_titles)
+                counts['cached_files'] = len(cached_localizations)
+        files_to_localize = [i for i in range(len(input_file)) if i not in cached_localizations]
+
+        # Read input files----------------------------------------------------------------------------------------------
+        # input_data is a list of FileTuples (filename, pandas DataFrame of the csv)
+        with profile_stage(profile, 'ingest', files=len(files_to_localize)) as counts:
+            input_data: List[FileTuple] = ingest_file_data(files=[input_file[i] for i in files_to_localize])
+            counts['rows'] = sum(len(ftuple.FileData) for ftuple in input_data)
+        # End of Data file reading--------------------------------------------------------------------------------------
+
+        # get the sequence from the without the cleavage annotations, etc. from the annotated sequence column
+        with profile_stage(profile, 'raw_sequences', rows=sum(len(ftuple.FileData) for ftuple in input_data)):
+            data = [gen_raw_sequences(ftuple) for ftuple in input_data]
+        # the abundance columns of each file
+        file_abundance_col_titles: List[List[str]] = [abundance_col_titles] * len(data)
+        if using_file_id_column:
+            file_abundance_col_titles = []
+            reformatted_data = []
+            with profile_stage(profile, 'fileid_conversion', rows=sum(len(ftuple.FileData) for ftuple in data)) \
+                    as counts:
+                for ftuple in data:
+                    tup = convert_fileidtoabundaceformat(ftuple, sanitize_str_for_dataframe_index(fileid_col_name),
+                                                         abundance_col_titles[0])
+                    file_abundance_col_titles.append(tup[0])
+                    reformatted_data.append(tup[1])
+                counts['channels'] = sum(len(titles) for titles in file_abundance_col_titles)
+            data = reformatted_data
+
+        if workers > 1 and not save_localization and not cache_directory:
+            # Localize and calculate the abundances of each input file against batches of the proteins in worker
+            # processes. Localization and the abundance calculations run in the workers, so they are profiled
+            # together, with the CPU time and peak memory of the workers
+            n_channels = sum(len(titles) for titles in file_abundance_col_titles)
+            if using_file_id_column and not state_directory:
+                # every input file is calculated against the fileIDs of every input file
+                abundance_col_titles = [title for titles in file_abundance_col_titles for title in titles]
+                file_abundance_col_titles = [abundance_col_titles] * len(data)
+            with profile_stage(profile, 'parallel_analysis', rows=sum(len(ftuple.FileData) for ftuple in data),
+                               proteins=len(protein_seq_records), channels=n_channels):
+                for residue_analysis, peptide_analysis in parallel_file_analysis(
+                        data, workers, protein_seq_records, mod_regex, file_abundance_col_titles, protein_index,
+                        master_localization, should_calculate_peptide_modifications, multiple_localizations):
+                    residue_analysis_all_prot.append(residue_analysis)
+                    if should_calculate_peptide_modifications:
+                        peptide_analysis_all_prot.append(peptide_analysis)
+        else:
+            # the localized FileTuple, the {proteinID: column title} dicts of the modification and fragment
+            # localization columns, and the abundance columns of each input file
+            file_localizations = cached_localizations
+
+            # Localization of fragments and modifications---------------------------------------------------------------
+            if files_to_localize and protein_index is None and master_localization is None:
+                with profile_stage(profile, 'protein_index', proteins=len(protein_seq_records)):
+                    protein_index = build_protein_index(protein_seq_records)
+            for i, ftuple, ftuple_abundance_col_titles in zip(files_to_localize, data, file_abundance_col_titles):
+                with profile_stage(profile, 'localization', rows=len(ftuple.FileData)) as counts:
+                    localized_ftuple, mod_loc_col_titles, frag_loc_col_titles = \
+                        localize_fragments(ftuple, protein_seq_records, mod_regex, protein_index, master_localization,
+                                           multiple_localizations)
+                    counts['proteins'] = len(localized_ftuple.Localizations)
+                file_localizations[i] = (localized_ftuple, mod_loc_col_titles, frag_loc_col_titles,
+                                         ftuple_abundance_col_titles)
+                if save_localization:
+                    with profile_stage(profile, 'save_localization', rows=len(localized_ftuple.FileData)):
+                        save_localized_data(*file_localizations[i],
+                                            localized_output_path(input_file[i], output_directory))
+                if cache_directory:
+                    with profile_stage(profile, 'cache_store', rows=len(localized_ftuple.FileData)):
+                        store_localization_cache(cache_directory, cache_keys[i], *file_localizations[i],
+                                                 max_size=cache_max_size)
+            # End of fragment and modification localization-------------------------------------------------------------
+
+            # Dicts to store the indices for the data generated by localizing the fragments and modifications
+            modification_localization_col_titles: Dict[str, str] = dict()  # Dict containing {proteinID: column title}
+            frag_localization_col_titles: Dict[str, str] = dict()  # Dict containing {proteinID: column title}
+            # list that will contain the FileTuples after the fragments contained have been localized
+            localized_data: List[FileTuple] = []  # contains the FileTuples once they have been localized
+            file_abundance_col_titles = []
+            for i in range(len(input_file)):
+                localized_ftuple, mod_loc_col_titles, frag_loc_col_titles, ftuple_abundance_col_titles = \
+                    file_localizations[i]
+                localized_data.append(localized_ftuple)
+                modification_localization_col_titles.update(mod_loc_col_titles)
+                frag_localization_col_titles.update(frag_loc_col_titles)
+                file_abundance_col_titles.append(ftuple_abundance_col_titles)
+            if using_file_id_column and not state_directory:
+                # every input file is calculated against the fileIDs of every input file
+                abundance_col_titles = [title for titles in file_abundance_col_titles for title in titles]
+                file_abundance_col_titles = [abundance_col_titles] * len(localized_data)
+
+            residue_analysis_all_prot, peptide_analysis_all_prot = calc_localized_abundances(
+                localized_data, modification_localization_col_titles, frag_localization_col_titles,
+                file_abundance_col_titles, protein_seq_records, should_calculate_peptide_modifications, profile)
+
+    if state_directory and not localized_files and not analyses_written:
+        # store the analyses of the input files analyzed in this run, and put them in order with the stored ones
+        with profile_stage(profile, 'state_store', files=len(input_file)):
+            new_analyses = zip(residue_analysis_all_prot, peptide_analysis_all_prot
+                               if should_calculate_peptide_modifications else repeat(None))
+            residue_analysis_all_prot = []
+            peptide_analysis_all_prot = []
+            for i, state_key in enumerate(state_keys):
+                if i in stored_analyses:
+                    residue_analysis, peptide_analysis = stored_analyses[i]
+                else:
+                    residue_analysis, peptide_analysis = next(new_analyses)
+                    store_analysis_state(state_directory, state_key, residue_analysis, peptide_analysis)
+                residue_analysis_all_prot.append(residue_analysis)
+                if should_calculate_peptide_modifications:
+                    peptide_analysis_all_prot.append(peptide_analysis)
+            prune_analysis_state(state_directory, state_keys)
+        analysis_files = all_input_files
+
+    # output the abundance data-----------------------------------------------------------------------------------------
+    if not analyses_written:
+        with profile_stage(profile, 'output', files=len(analysis_files)):
+            if output_format in ('long_csv', 'parquet'):
+                output_analysis_tables(analysis_files, residue_analysis_all_prot, peptide_analysis_all_prot,
+                                       output_directory, residue_output_name_stub,
+                                       peptide_output_name_stub if should_calculate_peptide_modifications else None,
+                                       output_format, output_compression)
+            else:
+                output_analysis_csvs(residue_analysis_all_prot, peptide_analysis_all_prot, output_directory,
+                                     residue_output_name_stub,
+                                     peptide_output_name_stub if should_calculate_peptide_modifications else None)
     # End of data output------------------------------------------------------------------------------------------------
+    if profile is not None:
+        profile.write_report(profile_report)
     # End of program
     return
 
 
+# BatchJob is one run of main in a batch. Name identifies it in errors, Configuration is the parsed configuration to
+# run and ProfileReport, when not None, the profile_report to run it with
+BatchJob = namedtuple("BatchJob", ['Name', 'Configuration', 'ProfileReport'], defaults=(None,))
+
+# Keys of a manifest job that describe the job rather than override its configuration
+MANIFEST_JOB_KEYS: Tuple[str, ...] = ('name', 'config', 'profile_report')
+
+
+def merge_configuration(configuration: dict, overrides: dict) -> dict:
+    """
+    :return: a copy of configuration with the settings of overrides in place of its own, tables are merged key by key
+    """
+    merged = dict(configuration)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_configuration(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def config_batch(config_paths: List[str]) -> List[BatchJob]:
+    """
+    :return: a BatchJob running each configuration file
+    """
+    return [BatchJob(Name=config_path, Configuration=toml.load(config_path)) for config_path in config_paths]
+
+
+def read_manifest(manifest_path: str) -> List[BatchJob]:
+    """
+    Reads a manifest of the jobs of a batch. A manifest is a TOML file with a [[job]] table per job. The config key of a
+    job, or of the manifest for jobs without their own, is the configuration file the job runs, relative to the
+    manifest. Every other table and setting of the job, except its name and profile_report, overrides the same one of
+    the configuration file, so jobs that only differ in their input and output can share a configuration file
+    :param manifest_path: path of the manifest
+    :return: the BatchJob of each job of the manifest, in order
+    """
+    manifest = toml.load(manifest_path)
+    manifest_directory = os.path.dirname(manifest_path)
+    # each configuration file is only read once however many jobs use it
+    configurations: Dict[str, dict] = {}
+    batch = []
+    for i, job in enumerate(manifest.get('job', [])):
+        config_path = job.get('config', manifest.get('config'))
+        if config_path is None:
+            raise ValueError("job " + str(i + 1) + " of manifest " + manifest_path + " has no config file")
+        config_path = os.path.join(manifest_directory, config_path)
+        if config_path not in configurations:
+            configurations[config_path] = toml.load(config_path)
+        overrides = {key: value for key, value in job.items() if key not in MANIFEST_JOB_KEYS}
+        batch.append(BatchJob(Name=job.get('name', config_path + " (job " + str(i + 1) + ")"),
+                              Configuration=merge_configuration(configurations[config_path], overrides),
+                              ProfileReport=job.get('profile_report')))
+    return batch
+
+
+def run_batch(batch: List[BatchJob], jobs: int = None, profile_report: str = None,
+              metrics_hook: Callable[[str, Dict], None] = None, keep_going: bool = False) -> List[str]:
+    """
+    Runs every job of a batch in this process, one after the other. Modules are only imported, regexes compiled and
+    fasta files read and indexed once for the whole batch rather than once per job
+    :param batch: the BatchJobs to run
+    :param jobs: the number of worker processes of every job, overrides the workers setting of their configurations
+    :param profile_report: the profile_report of main for jobs without their own ProfileReport
+    :param metrics_hook: the metrics_hook of main for every job
+    :param keep_going: whether to report the error of a failed job to stderr and carry on with the rest of the batch
+    rather than stop at the first error
+    :return: the names of the jobs that failed, in order
+    """
+    failed = []
+    for batch_job in batch:
+        try:
+            main(jobs=jobs, profile_report=batch_job.ProfileReport if batch_job.ProfileReport is not None
+                 else profile_report, metrics_hook=metrics_hook, configuration=batch_job.Configuration)
+        except Exception:
+            if not keep_going:
+                raise
+            print("job " + batch_job.Name + " failed:", file=sys.stderr)
+            traceback.print_exc()
+            failed.append(batch_job.Name)
+    return failed
+
+
+# Counts of a PipelineProfile stage that add up over the runs of the stage
+SUMMED_COUNTS: Tuple[str, ...] = ('rows', 'files')
+
+
+class PipelineProfile:
+    """
+    Wall time, CPU time, peak resident memory and row, protein and channel counts of each stage of main(). A stage run
+    more than once, such as the stages of each chunk when streaming, is reported once with its times summed, its peak
+    memory the largest of its runs, its SUMMED_COUNTS summed and its other counts the largest of its runs
+    """
+
+    def __init__(self, metrics_hook: Callable[[str, Dict], None] = None):
+        """
+        :param metrics_hook: called with the name and measurements of each stage as each run of it finishes, to forward
+        them to a metrics system
+        """
+        self.metrics_hook = metrics_hook
+        # stage name mapped to its measurements, in the order the stages first ran
+        self.stages: Dict[str, Dict] = {}
+        self.start_wall: float = time.perf_counter()
+        self.start_cpu: float = cpu_time()
+
+    @contextmanager
+    def stage(self, name: str, **counts) -> Iterator[Dict[str, int]]:
+        """
+        Measures the body of a with statement as a run of a stage
+        :param name: the name of the stage
+        :param counts: counts of what the stage works on known before it runs, such as rows=len(file_data)
+        :return: the dict of the counts, which counts only known once the stage has run can be added to
+        """
+        peak_resettable = reset_peak_rss()
+        start_wall = time.perf_counter()
+        start_cpu = cpu_time()
+        yield counts
+        measurements = {'wall_seconds': time.perf_counter() - start_wall, 'cpu_seconds': cpu_time() - start_cpu,
+                        # without resetting the peak it is the peak of the process so far
+                        'peak_rss_bytes': peak_rss(), 'peak_rss_reset': peak_resettable,
+                        'children_peak_rss_bytes': children_peak_rss(), 'counts': counts}
+        if self.metrics_hook is not None:
+            self.metrics_hook(name, measurements)
+
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = dict(calls=1, **measurements)
+            self.stages[name]['counts'] = dict(counts)
+            return
+        stage['calls'] += 1
+        stage['wall_seconds'] += measurements['wall_seconds']
+        stage['cpu_seconds'] += measurements['cpu_seconds']
+        for measurement in ('peak_rss_bytes', 'children_peak_rss_bytes'):
+            stage[measurement] = max(stage[measurement], measurements[measurement])
+        stage['peak_rss_reset'] = stage['peak_rss_reset'] and peak_resettable
+        for count, value in counts.items():
+            if count in SUMMED_COUNTS:
+                stage['counts'][count] = stage['counts'].get(count, 0) + value
+            else:
+                stage['counts'][count] = max(stage['counts'].get(count, value), value)
+
+    def report(self) -> Dict:
+        """
+        :return: the measurements of every stage and of the whole run so far, in a form that can be written as JSON
+        """
+        return {'wall_seconds': time.perf_counter() - self.start_wall, 'cpu_seconds': cpu_time() - self.start_cpu,
+                'peak_rss_bytes': peak_rss(), 'children_peak_rss_bytes': children_peak_rss(),
+                'stages': [dict(stage=name, **measurements) for name, measurements in self.stages.items()]}
+
+    def write_report(self, path: str):
+        """
+        Writes the report of the run as JSON
+        :param path: path of the JSON file, its directory is created if it does not exist
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as outfile:
+            json.dump(self.report(), outfile, indent=2)
+
+
+def profile_stage(profile: PipelineProfile, name: str, **counts) -> ContextManager[Dict[str, int]]:
+    """
+    :return: the PipelineProfile.stage context of the stage, or a context that measures nothing when profile is None
+    """
+    return profile.stage(name, **counts) if profile is not None else nullcontext(counts)
+
+
+def cpu_time() -> float:
+    """
+    :return: the user and system CPU seconds used by this process and by its child processes that have exited, which
+    includes the worker processes once their pool is shut down
+    """
+    children_times = os.times()
+    return time.process_time() + children_times.children_user + children_times.children_system
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident memory of the process to its current resident memory, so peak_rss gives the peak of what
+    runs next. Only supported on Linux
+    :return: whether the peak could be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """
+    :return: the peak resident memory of this process in bytes, since the last reset_peak_rss
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return max_rss(resource.RUSAGE_SELF) if resource is not None else 0
+
+
+def children_peak_rss() -> int:
+    """
+    :return: the peak resident memory in bytes of the largest child process that has exited, 0 if there were none
+    """
+    return max_rss(resource.RUSAGE_CHILDREN) if resource is not None else 0
+
+
+def max_rss(who: int) -> int:
+    """
+    :return: the ru_maxrss of getrusage in bytes, which is in kilobytes on Linux and bytes on macOS
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def load_metrics_hook(hook_path: str) -> Callable[[str, Dict], None]:
+    """
+    Imports the function given as "module:function"
+    :param hook_path: the module and name of the function
+    :return: the function
+    """
+    module_name, _, function_name = hook_path.partition(':')
+    if not function_name:
+        raise ValueError("The metrics hook {} should be given as module:function".format(hook_path))
+    return getattr(importlib.import_module(module_name), function_name)
+
+
 def gen_raw_sequences(ftuple: FileTuple) -> FileTuple:
     """
     Adds a column to the DataFrame containing a stripped down peptide without the cleavage annotations
@@ -164,65 +755,280 @@ def gen_raw_sequences(ftuple: FileTuple) -> FileTuple:
     return FileTuple(ftuple.FileName, file_data)
 
 
-def parse_masterlocalizations(ftuple: FileTuple, master_prot_fasta_id, mod_regex, pos_master_regex) -> Tuple[
-    FileTuple, Dict[str, str], Dict[str, str]]:
+def localize_fragments(ftuple: FileTuple, protein_seq_records: Dict, mod_regex: str,
+                       protein_index: ProteinIndex = None, master_localization: Tuple[Dict[str, str], str] = None,
+                       multiple_localizations: str = 'first') -> Tuple[FileTuple, Dict[str, str], Dict[str, str]]:
+    """
+    Localizes each fragment within the proteins provided, either via master protein or via the protein fasta files
+    provided in the configuration
+    :param ftuple: a FileTuple with the data to localize
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param mod_regex: The regex string to use to parse out the modifications from the modifications column
+    :param protein_index: the ProteinIndex to align the fragments with when not using the master protein
+    :param master_localization: a tuple of the dict mapping the name of each master protein to its fasta ID and the
+    position in master regex to localize using the master protein positions and modifications, None to align against
+    the proteins instead
+    :param multiple_localizations: how the abundance of a fragment localized more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: a Tuple containing the FileTuple with localization data, a Dict mapping the proteinID to its modification
+    localizations in the DataFrame, and a Dict mapping proteinID's to their fragment localizations in the DataFrame
+    """
+    if master_localization is not None:  # localize using the master protein positions and modifications
+        master_proteins, master_regex = master_localization
+        return parse_masterlocalizations(ftuple, master_proteins, mod_regex, master_regex, multiple_localizations)
+    # localize by aligning the fragment against a protein and looking at the modification index within the fragment
+    return parse_prot_localizations(ftuple, protein_seq_records, mod_regex, protein_index, multiple_localizations)
+
+
+# ParsedModifications holds the one indexed Positions of the modifications parsed out of a modification string, the
+# Residues (the first character matched by the modification regex, e.g. S for S383) modified at each position, and
+# the site Probabilities of the modifications, 1 where the string doesn't give one
+ParsedModifications = namedtuple("ParsedModifications", ['Positions', 'Residues', 'Probabilities'])
+
+NO_MODIFICATIONS = ParsedModifications(Positions=(), Residues=(), Probabilities=())
+
+# Name of the capturing group of a modification regex holding the site probability of the modification, in percent
+PROBABILITY_GROUP: str = 'probability'
+
+# the number of distinct modification and position strings to remember the parse of
+PARSE_CACHE_SIZE: int = 1 << 16
+
+
+@lru_cache(maxsize=None)
+def compile_regex(pattern: str) -> Pattern:
+    """
+    :return: the compiled regex of a pattern from the regex configuration, each pattern is only compiled once
+    """
+    return re.compile(pattern)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_modification_string(mod_string: str, mod_regex: str) -> ParsedModifications:
+    """
+    Parses the modification localizations out of a modification string, e.g. "2xPhospho [S6; S]"
+    :param mod_string: the modification string
+    :param mod_regex: the regex string to use to parse out the modifications. Each non empty capturing group of a
+    match is the localization of a modification, except a PROBABILITY_GROUP which is the site probability of the
+    match's modifications, e.g. 99.2 of "S6(99.2)"
+    :return: the ParsedModifications of the string
+    """
+    regex = compile_regex(mod_regex)
+    probability_group = regex.groupindex.get(PROBABILITY_GROUP)
+    positions = []
+    residues = []
+    probabilities = []
+    for match_obj in regex.finditer(mod_string):
+        probability = match_obj.group(probability_group) if probability_group is not None else None
+        # each group in the match_obj corresponds to a match for the capturing group [\d]{0,} (one or more digits)
+        # and this gives us the index of the modification localization. Modifications without a localization, e.g.
+        # the second S of [S6; S], have an empty group
+        for group, mod_localization in enumerate(match_obj.groups(), 1):
+            if mod_localization and group != probability_group:
+                positions.append(int(mod_localization))
+                residues.append(match_obj.group(0)[:1])
+                probabilities.append(float(probability) / 100 if probability else 1.0)
+    return ParsedModifications(Positions=tuple(positions), Residues=tuple(residues),
+                               Probabilities=tuple(probabilities))
+
+
+def parse_modification_column(mod_strings: pd.Series, mod_regex: str) -> \
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parses every row of a modification column, parsing each distinct modification string only once
+    :param mod_strings: the column of modification strings, NaN where a fragment has no modifications
+    :param mod_regex: the regex string to use to parse out the modifications
+    :return: a tuple of the code of each row into the distinct modifications, and the offsets, one indexed positions
+    and site probabilities of the distinct modifications, those of code c being positions[offsets[c]:offsets[c + 1]].
+    The probabilities are None when mod_regex has no PROBABILITY_GROUP
+    """
+    codes, distinct_mod_strings = pd.factorize(mod_strings)
+    # pandas seems to treat the items in the mod column as str, unless its not there and then its a float nan, which
+    # factorize gives the code -1, picking the NO_MODIFICATIONS at the end
+    parsed = [parse_modification_string(str(mod_string), mod_regex) for mod_string in distinct_mod_strings]
+    parsed.append(NO_MODIFICATIONS)
+    offsets = csr_offsets([len(parsed_mods.Positions) for parsed_mods in parsed])
+    positions = np.fromiter((position for parsed_mods in parsed for position in parsed_mods.Positions),
+                            dtype=np.int32, count=offsets[-1])
+    probabilities = np.fromiter((probability for parsed_mods in parsed for probability in parsed_mods.Probabilities),
+                                dtype=float, count=offsets[-1]) \
+        if PROBABILITY_GROUP in compile_regex(mod_regex).groupindex else None
+    return np.where(codes == -1, len(parsed) - 1, codes), offsets, positions, probabilities
+
+
+def csr_offsets(lengths) -> np.ndarray:
+    """
+    :return: the offsets of segments of the given lengths laid out end to end, starting with 0 and ending with the
+    total length
+    """
+    return np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+
+def gather_segments(offsets: np.ndarray, segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lays segments of a CSR style array out end to end
+    :param offsets: the offsets of the segments of the array, segment s spanning offsets[s]:offsets[s + 1]
+    :param segments: the segments to gather, in order, segments can be gathered more than once
+    :return: a tuple of the offsets of the gathered segments and the index into the array of each gathered value
+    """
+    starts = offsets[segments]
+    lengths = offsets[segments + 1] - starts
+    return csr_offsets(lengths), expand_ranges(starts, starts + lengths - 1)[1]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_master_positions(pos_in_master_str: str, pos_master_regex: str) -> Tuple[Tuple[int, int], ...]:
+    """
+    Parses the fragment localizations out of a position in master string, e.g. "P10636-8 [355-377]"
+    :param pos_in_master_str: the position in master string
+    :param pos_master_regex: the regex to use to parse out the positions, capturing the start and end of the fragment
+    :return: a tuple of the one indexed (start, end) of each position, end inclusive
+    """
+    # want the first number (the start index of the fragment) and the second number,
+    # so we only get capturing group 1 and capturing group 2
+    # capturing group 0 is the whole match e.g. [355-377] and capturing group 2 is the second number e.g. 377
+    # end of fragment is inclusive- end 377 includes aa 377
+    return tuple((int(match_obj.group(1)), int(match_obj.group(2)))
+                 for match_obj in compile_regex(pos_master_regex).finditer(pos_in_master_str))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def split_master_proteins(master_str: str, master_protein_names: Tuple[str, ...]) -> Dict[str, str]:
+    """
+    Splits a positions or modifications in master proteins string, e.g. "P10636-8 [262-269]; P27546 [981-988]" or
+    "P10636-8 1xCarbamidomethyl [C291]; 1xPhospho [S293]", into the part of it belonging to each master protein. The
+    string is split at the semicolons outside of brackets, each part starting with the name of its protein unless it
+    starts with a bracket or a modification count, e.g. 1xPhospho, continuing the part before it
+    :param master_str: the positions or modifications in master proteins string
+    :param master_protein_names: the names of the master proteins in the data, e.g. P10636-8
+    :return: a dict mapping the name of each master protein in the string to its part of the string, without the
+    name. The parts before the first name are the only master protein's when there is only one
+    """
+    parts = {}
+    protein_name = master_protein_names[0] if len(master_protein_names) == 1 else None
+    for part in compile_regex(r';(?![^\[]*\])').split(master_str):
+        first_word, _, rest = part.strip().partition(' ')
+        if not (first_word.startswith('[') or compile_regex(r'\d+x').match(first_word)):
+            protein_name, part = first_word, rest
+        if protein_name in master_protein_names:
+            parts[protein_name] = parts[protein_name] + ';' + part if protein_name in parts else part
+    return parts
+
+
+def parse_masterlocalizations(ftuple: FileTuple, master_proteins: Dict[str, str], mod_regex, pos_master_regex,
+                              multiple_localizations: str = 'first') -> Tuple[FileTuple, Dict[str, str],
+                                                                              Dict[str, str]]:
     """
     Parses the modification and fragment localizations from a DataFrame using the positions in master and modifications
     in master proteins columns to obtain localization data instead of aligning the fragment to a given master protein
     :param pos_master_regex: the regex to use to parse out position in master from the 'position in master' column
     :param mod_regex: the regex to use to parse out the modifications from 'modifications in master proteins'
-    :param ftuple:
-    :param master_prot_fasta_id:
-    :return: A tuple containing the FileTuple of localized data, a Dict mapping the proteinID to its modification \
-    localizations in the DataFrame, and a Dict mapping proteinID's to their fragment localizations in the DataFrame
+    :param ftuple: a FileTuple with the data to localize
+    :param master_proteins: dict mapping the name of each master protein in the data to its fasta ID
+    :param multiple_localizations: how the abundance of a fragment at more than one position is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: A tuple containing the FileTuple with the ProteinLocalization of each master protein, a Dict mapping the
+    proteinID to the title of its modification localizations, and a Dict mapping proteinID's to the title of their
+    fragment localizations
     """
-    # NOTE: parses multiple master proteins, but as of now only the first is used
     # this provides support for non-localized PTM where only the amino acid is present and not the localization
     file_data: pd.DataFrame = ftuple.FileData
-    localizations = []
-    positions_in_master = []
+    master_protein_names = tuple(master_proteins)
+
+    # each distinct string is only split into its master proteins once, rows without one (code -1) get no master
+    # proteins
+    # example mod_string "P10636-8 2xPhospho [S383; S]", sample pos_in_master_str: "P10636-8 [355-377]"
+    mod_codes, distinct_mod_strings = pd.factorize(file_data['modifications_in_master_proteins'])
+    mod_parts = [split_master_proteins(str(mod_string), master_protein_names) for mod_string in distinct_mod_strings]
+    mod_parts.append({})
+    mod_codes = np.where(mod_codes == -1, len(mod_parts) - 1, mod_codes)
+    pos_codes, distinct_pos_strings = pd.factorize(file_data['positions_in_master_proteins'])
+    pos_parts = [split_master_proteins(str(pos_in_master_str), master_protein_names)
+                 for pos_in_master_str in distinct_pos_strings]
+    pos_parts.append({})
+    pos_codes = np.where(pos_codes == -1, len(pos_parts) - 1, pos_codes)
 
-    for row in file_data.itertuples():
+    localizations = {}
+    for master_protein_name, master_prot_fasta_id in master_proteins.items():
         # Modification localization occurs here:------------------------------------------------------------------------
-        mod_string = row.modifications_in_master_proteins
-        # example mod_string "P10636-8 2xPhospho [S383; S]"
-        # pandas seems to treat the items in the mod column as str, unless its not there and then its a float nan
-        # force everything into string so we can make sure its not empty ("nan")
-        if not str(mod_string) == "nan":
-            matches = re.finditer(mod_regex, mod_string)
-            # each group in the match_obj corresponds to a match for the capturing group [\d]{0,} (one or more digits)
-            # and this gives us the index of the modification localization
-            # NOTE: ONE INDEXED e.g. 1st amino acid=1
-            localizations.append([int(mod_localization) for match_obj in matches
-                                  for mod_localization in match_obj.groups() if mod_localization is not ''])
-        else:
-            localizations.append([])  # If it's nan there isn't a modification, indicate this as an empty list of mods
+        # each distinct modification string is only parsed once
+        # NOTE: ONE INDEXED e.g. 1st amino acid=1
+        parsed_mods = [parse_modification_string(parts[master_protein_name], mod_regex)
+                       if master_protein_name in parts else NO_MODIFICATIONS for parts in mod_parts]
+        mod_offsets = csr_offsets([len(parsed.Positions) for parsed in parsed_mods])
+        mod_positions = np.fromiter((position for parsed in parsed_mods for position in parsed.Positions),
+                                    dtype=np.int32, count=mod_offsets[-1])
+        mod_probabilities = np.fromiter((probability for parsed in parsed_mods for probability in parsed.Probabilities),
+                                        dtype=float, count=mod_offsets[-1])
         # End of modification localization------------------------------------------------------------------------------
 
         # Fragment localization in protein occurs here------------------------------------------------------------------
-        # sample pos_in_master_str: P10636-8 [355-377]
-        pos_in_master_str = row.positions_in_master_proteins
-        if not str(pos_in_master_str) == "nan":
-            matches = re.finditer(pos_master_regex, pos_in_master_str)
-            # want the first number (the start index of the fragment) and the second number,
-            # so we only get capturing group 1 and capturing group 2
-            # capturing group 0 is the whole match e.g. [355-377] and capturing group 2 is the second number e.g. 377
-            # end of fragment is inclusive- end 377 includes aa 377
-            positions_in_master.append([(int(match_obj.group(1)), int(match_obj.group(2)))
-                                        for match_obj in matches])
-        else:
-            positions_in_master.append((-1))  # No position in master string
+        # each distinct position in master string is only parsed once
+        parsed_positions = [parse_master_positions(parts[master_protein_name], pos_master_regex)
+                            if master_protein_name in parts else () for parts in pos_parts]
+        pos_offsets = csr_offsets([len(positions) for positions in parsed_positions])
+        positions = np.array([position for positions in parsed_positions for position in positions],
+                             dtype=np.int32).reshape(-1, 2)
         # End of fragment localization----------------------------------------------------------------------------------
 
-    # Add the columns containing the modification and fragment localization to the DataFrame
-    file_data.insert(file_data.shape[1], "master_localized_mods", localizations)
-    file_data.insert(file_data.shape[1], "master_frag_localization", positions_in_master)
+        # only the rows with a position in the master protein are localized, along with their modifications
+        rows = np.flatnonzero(pos_offsets[pos_codes + 1] > pos_offsets[pos_codes])
+        frag_offsets, frag_indices = gather_segments(pos_offsets, pos_codes[rows])
+        row_mod_offsets, mod_indices = gather_segments(mod_offsets, mod_codes[rows])
+        localizations[master_prot_fasta_id] = ProteinLocalization(
+            Rows=rows, FragOffsets=frag_offsets, FragStarts=positions[frag_indices, 0],
+            FragEnds=positions[frag_indices, 1], ModOffsets=row_mod_offsets, ModPositions=mod_positions[mod_indices],
+            ModWeights=mod_probabilities[mod_indices] if PROBABILITY_GROUP in compile_regex(mod_regex).groupindex
+            else None)
 
-    return FileTuple(ftuple.FileName, file_data), {master_prot_fasta_id: "master_localized_mods"}, \
-           {master_prot_fasta_id: "master_frag_localization"}
+    if multiple_localizations == 'all':
+        # every master protein is localized at once, so the positions of each row in all of them are known here
+        row_occurrences = np.zeros(len(file_data), dtype=np.int64)
+        for localization in localizations.values():
+            row_occurrences[localization.Rows] += np.diff(localization.FragOffsets)
+        localizations = share_fragment_abundances(localizations, row_occurrences)
+    elif multiple_localizations == 'protein':
+        localizations = share_fragment_abundances(localizations)
 
+    if len(master_proteins) == 1:
+        master_prot_fasta_id = master_proteins[master_protein_names[0]]
+        return ftuple._replace(FileData=file_data, Localizations=localizations), \
+            {master_prot_fasta_id: "master_localized_mods"}, {master_prot_fasta_id: "master_frag_localization"}
+    # several master proteins are named after their proteins, the way the aligned proteins are
+    return ftuple._replace(FileData=file_data, Localizations=localizations), \
+        {prot_id: sanitize_str_for_dataframe_index(prot_id) + "_mod_localization" for prot_id in localizations}, \
+        {prot_id: sanitize_str_for_dataframe_index(prot_id) + "_fragment_localization" for prot_id in localizations}
 
-def parse_prot_localizations(ftuple: FileTuple, protein_seq_records: Dict, mod_regex: str) -> \
+
+def share_fragment_abundances(localizations: Dict[str, ProteinLocalization],
+                              row_occurrences: np.ndarray = None) -> Dict[str, ProteinLocalization]:
+    """
+    Shares the abundance of each fragment evenly between its occurrences, giving the ProteinLocalizations FragWeights
+    :param localizations: dict mapping proteinID to the ProteinLocalization of the fragments in the protein
+    :param row_occurrences: the number of occurrences of the fragment of each row of the DataFrame in every protein,
+    to share the abundance between all of them. None to share it between the occurrences in each protein, so each
+    protein gets all of it
+    :return: the localizations with the share of each occurrence in their FragWeights
+    """
+    shared = {}
+    for prot_id, localization in localizations.items():
+        occurrences = np.diff(localization.FragOffsets)
+        shares = 1.0 / (row_occurrences[localization.Rows] if row_occurrences is not None else occurrences)
+        shared[prot_id] = localization._replace(FragWeights=np.repeat(shares, occurrences))
+    return shared
+
+
+def empty_protein_localization() -> ProteinLocalization:
+    """
+    :return: a ProteinLocalization of no fragments
+    """
+    offsets = np.zeros(1, dtype=np.int64)
+    positions = np.zeros(0, dtype=np.int32)
+    return ProteinLocalization(Rows=np.zeros(0, dtype=np.int64), FragOffsets=offsets, FragStarts=positions,
+                               FragEnds=positions, ModOffsets=offsets, ModPositions=positions)
+
+
+def parse_prot_localizations(ftuple: FileTuple, protein_seq_records: Dict, mod_regex: str,
+                             protein_index: ProteinIndex = None, multiple_localizations: str = 'first') -> \
         Tuple[FileTuple, Dict[str, str], Dict[str, str]]:
     """
     Parses out the localizations of the PTM by aligning each modified fragment to the protein sequences given in
@@ -230,59 +1036,104 @@ def parse_prot_localizations(ftuple: FileTuple, protein_seq_records: Dict, mod_r
     the full protein as an offset to calculate the localization's index in the full protein.
     :param mod_regex: The regex string to use to parse out the modifications from the modifications column
     :param ftuple: a FileTuple with the data to localize
-    :param protein_seq_records: the dict of proteinID mapped to its SequenceRecord
-    :return: a Tuple containing the FileTuple with localization data, a Dict mapping the proteinID to its modification
-    localizations in the DataFrame, and a Dict mapping proteinID's to their fragment localizations in the DataFrame
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param protein_index: a ProteinIndex over protein_seq_records to locate the fragments with, so one index can be
+    shared by every input file. Built from protein_seq_records if not given
+    :param multiple_localizations: how the abundance of a fragment occurring more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS. Shared between every protein of protein_index for 'all', even those not in
+    protein_seq_records
+    :return: a Tuple containing the FileTuple with the ProteinLocalization of each protein, a Dict mapping the proteinID
+    to the title of its modification localizations, and a Dict mapping proteinID's to the title of their fragment
+    localizations
     """
 
     file_data: pd.DataFrame = ftuple.FileData
-    mod_loc_column_titles = dict()  # maps Sequence Record ID to modification localization column name in DataFrame
-    frag_loc_column_titles = dict()  # maps Sequence Record ID to fragment localization column name in DataFrame
+    mod_loc_column_titles = dict()  # maps Sequence Record ID to the title of its modification localizations
+    frag_loc_column_titles = dict()  # maps Sequence Record ID to the title of its fragment localizations
+    localizations = dict()  # maps Sequence Record ID to the ProteinLocalization of the fragments in it
+
+    if protein_index is None:
+        protein_index = build_protein_index(protein_seq_records)
+    # every occurrence of each distinct fragment in every protein, looked up once per distinct fragment
+    codes, peptides = pd.factorize(file_data['stripped_sequence'])
+    peptide_occurrences = locate_peptides(protein_index, peptides)
+    peptide_lens = np.array([len(peptide) for peptide in peptides], dtype=np.int64)
+    # the rows of the fragment with code c are rows_by_peptide[peptide_row_offsets[c]:peptide_row_offsets[c + 1]]
+    rows_by_peptide = np.argsort(codes, kind='stable')[np.count_nonzero(codes == -1):]
+    peptide_row_offsets = csr_offsets(np.bincount(codes[codes != -1], minlength=len(peptides)))
+
+    # the modifications of each row, relative to the start of the fragment. Each distinct modification string is only
+    # parsed once, and localizing them in a protein only adds the fragment's offset in that protein
+    mod_codes, mod_offsets, mod_positions, mod_probabilities = parse_modification_column(file_data['modifications'],
+                                                                                         mod_regex)
+
+    # the code of each distinct fragment found in a protein, with the zero indexed start of every occurrence in it
+    protein_hits: Dict[str, List[Tuple[int, List[int]]]] = {}
+    for code, peptide in enumerate(peptides):
+        for prot_id, frag_indices_in_prot in peptide_occurrences[peptide].items():
+            protein_hits.setdefault(prot_id, []).append((code, frag_indices_in_prot))
+    hit_numbers = np.zeros(len(peptides), dtype=np.int64)  # position of each fragment in the protein's hits
+    no_fragments = empty_protein_localization()
 
     # iterate through all the input proteins to localize against
-    for prot_id, protein in protein_seq_records.items():
-        prot_mod_localizations = []
-        positions_in_master = []  # master here is the protein currently being aligned against
-        # the protein sequence to align against to find the fragment's location in the sequence
-        protein_seq: str = protein.seq.upper()
-        for row in file_data.itertuples():
+    for prot_id in protein_seq_records:
+        hits = protein_hits.get(prot_id)
+        if hits is None:
+            localization = no_fragments  # none of the fragments are in this protein
+        else:
+            hit_codes = np.array([code for code, _ in hits], dtype=np.int64)
+            hit_numbers[hit_codes] = np.arange(len(hits))
             # Fragment localization occurs here-------------------------------------------------------------------------
-            frag_index_in_prot = protein_seq.find(row.stripped_sequence)  # find the fragment's index in the protein
-            # if the fragment is contained in the current protein
-            if frag_index_in_prot != -1:
-                # If the fragment is in the protein, add its localizations to the list
-                positions_in_master.append([(frag_index_in_prot + 1, frag_index_in_prot + len(row.stripped_sequence))])
-                # end of fragment localization--------------------------------------------------------------------------
-
-                # PTM modification localization occurs here-------------------------------------------------------------
-                mod_string = row.modifications
-                if not str(mod_string) == "nan":
-                    matches = re.finditer(mod_regex, mod_string)
-                    prot_mod_localizations.append([int(mod_localization) + frag_index_in_prot for match_obj in matches
-                                                   for mod_localization in match_obj.groups()
-                                                   if mod_localization is not ''])
-                else:
-                    prot_mod_localizations.append([])  # if no modifications add the list containing no modifications
-                # end of PTM/ modification localization-----------------------------------------------------------------
+            # zero indexed start of each occurrence of the fragments in the protein, in ascending order for each
+            # fragment, and the fragment length of each occurrence
+            occurrence_offsets = csr_offsets([len(frag_indices_in_prot) for _, frag_indices_in_prot in hits])
+            occurrence_starts = np.fromiter((frag_index for _, frag_indices_in_prot in hits
+                                             for frag_index in frag_indices_in_prot),
+                                            dtype=np.int64, count=occurrence_offsets[-1])
+            occurrence_lens = np.repeat(peptide_lens[hit_codes], np.diff(occurrence_offsets))
+            # every row whose fragment is contained in the current protein
+            rows = np.sort(np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                          [rows_by_peptide[peptide_row_offsets[code]:peptide_row_offsets[code + 1]]
+                                           for code in hit_codes]))
+            row_hits = hit_numbers[codes[rows]]
+            frag_offsets, occurrence_indices = gather_segments(occurrence_offsets, row_hits)
+            # end of fragment localization--------------------------------------------------------------------------
 
-            else:
-                prot_mod_localizations.append([frag_index_in_prot])  # if index is -1 the fragment isn't in this protein
-                positions_in_master.append([(-1,)])  # indicate that the fragment isn't in this protein
+            # PTM modification localization occurs here-------------------------------------------------------------
+            # modifications are localized relative to the first occurrence of the fragment
+            row_mod_offsets, mod_indices = gather_segments(mod_offsets, mod_codes[rows])
+            first_frag_indices = occurrence_starts[occurrence_offsets[row_hits]]
+            prot_mod_positions = mod_positions[mod_indices] + np.repeat(first_frag_indices, np.diff(row_mod_offsets))
+            # end of PTM/ modification localization-----------------------------------------------------------------
+
+            localization = ProteinLocalization(
+                Rows=rows, FragOffsets=frag_offsets,
+                FragStarts=(occurrence_starts[occurrence_indices] + 1).astype(np.int32),
+                FragEnds=(occurrence_starts[occurrence_indices] + occurrence_lens[occurrence_indices]).astype(np.int32),
+                ModOffsets=row_mod_offsets, ModPositions=prot_mod_positions.astype(np.int32),
+                ModWeights=mod_probabilities[mod_indices] if mod_probabilities is not None else None)
 
         # clean up the protein ID so we can use it to index things in our DataFrames
         sanitized_protein_id = sanitize_str_for_dataframe_index(prot_id)
 
-        prot_mod_column_title = sanitized_protein_id + "_mod_localization"
-        frag_loc_column_title = sanitized_protein_id + "_fragment_localization"
+        # the titles name the localizations of the protein in the outputs and saved localizations
+        mod_loc_column_titles.update({prot_id: sanitized_protein_id + "_mod_localization"})
+        frag_loc_column_titles.update({prot_id: sanitized_protein_id + "_fragment_localization"})
+        localizations.update({prot_id: localization})
 
-        # Add the localizations to the DataFrames and add the column headers to out dictionaries so we can get these
-        # columns later
-        file_data.insert(file_data.shape[1], prot_mod_column_title, prot_mod_localizations)
-        file_data.insert(file_data.shape[1], frag_loc_column_title, positions_in_master)
-        mod_loc_column_titles.update({protein.id: prot_mod_column_title})
-        frag_loc_column_titles.update({protein.id: frag_loc_column_title})
+    if multiple_localizations == 'all':
+        # the occurrences of each fragment in every protein of the index, so a batch of the proteins gets the same
+        # shares as localizing against all of them
+        peptide_occurrence_counts = [sum(len(frag_indices_in_prot) for frag_indices_in_prot in
+                                         peptide_occurrences[peptide].values()) for peptide in peptides]
+        # rows without a fragment (code -1) are in no protein
+        localizations = share_fragment_abundances(
+            localizations, np.array(peptide_occurrence_counts + [0], dtype=np.int64)[codes])
+    elif multiple_localizations == 'protein':
+        localizations = share_fragment_abundances(localizations)
 
-    return FileTuple(ftuple.FileName, file_data), mod_loc_column_titles, frag_loc_column_titles
+    return ftuple._replace(FileData=file_data, Localizations=localizations), mod_loc_column_titles, \
+        frag_loc_column_titles
 
 
 def calc_residue_mod_abundances(ftuple, localization_col_titles: Dict, frag_localization_col_titles: Dict,
@@ -291,171 +1142,2012 @@ def calc_residue_mod_abundances(ftuple, localization_col_titles: Dict, frag_loca
     """
     Calculates, for a DataFrame of localized ptm data, the abundance of each residue and how much that resiude is
     modified.
-    :param ftuple: FileTuple containing the file ID and the DataFrame with localized data
-    :param localization_col_titles: dict mapping protein ID to the column containing the mod localization
-    :param frag_localization_col_titles: dict mapping proteinID to the fragment localization column title
+    :param ftuple: FileTuple containing the file ID, the DataFrame and the localizations of its fragments
+    :param localization_col_titles: dict mapping protein ID to the title of its mod localizations
+    :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
     :param abundance_col_titles: list of titles of the abundance columns of interest in the DataFrame
-    :param protein_seq_records: dict containing the protein ID mapped to each SeqRecord
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
     :return: a dict mapping proteinIDs to their residue abundance arrays
     """
     fdata = ftuple.FileData
     all_prot_abundances: Dict[Dict] = {}  # a dict of each protein ID mapped a dict of column ids mapped to their
     # respective abundance arrays
 
-    # There are three nested levels here- each master protein is being analyzed against
-    # each abundance column fragment by fragment
+    # every abundance column is accumulated at once as one channel of a (rows, channels) matrix, or of the
+    # ChannelMatrix from a fileID column
+    abundance_col_titles = [sanitize_str_for_dataframe_index(title) for title in abundance_col_titles]
+    if ftuple.Channels is None:
+        channel_abundances = fdata[abundance_col_titles].to_numpy(dtype=float)
+    else:
+        row_channels = matrix_row_channels(ftuple.Channels, abundance_col_titles)
+
     for proteinID, mod_column_title in localization_col_titles.items():
         protein_len = len(protein_seq_records[proteinID])  # Get the protein length so we know how big to make the
         # array we're storing the abundances in
         res_abundance_col_title = mod_column_title.replace('_mod_localization', '')
-        all_prot_abundances[res_abundance_col_title] = {}
-        for abundance_col_title in abundance_col_titles:
-            abundance_col_title = sanitize_str_for_dataframe_index(abundance_col_title)
-            # THIS IS ONE INDEXED. RESIDUE 1 IS IN INDEX 1 of the array. index 0 is UNUSED
-            res_abundances = np.zeros((protein_len + 1, 2),
-                                      dtype=float)  # col. 0= mod abundance, col. 1=residue abundance
-            for row in fdata.iterrows():
-                fragment = row[1]
-                mod_localization = fragment[mod_column_title]
-                frag_localization = fragment[frag_localization_col_titles[proteinID]]
-                frag_abundance = fragment[abundance_col_title]
-
-                # if the fragment is in the given protein
-                if frag_localization[0][0] != -1:
-                    # only uses the first localization
-                    for i in range(frag_localization[0][0], frag_localization[0][1] + 1, 1):
-                        # add the abundance to the abundance of each residue in the fragment
-                        res_abundances[i][1] += frag_abundance
-                    for mod in mod_localization:
-                        # add the abundance to each modified residue contained in the fragment
-                        res_abundances[mod][0] += frag_abundance
-            assert (res_abundances[i][0] <= res_abundances[i][1] for i in range(0, len(res_abundances)))
-            all_prot_abundances[res_abundance_col_title][abundance_col_title] = res_abundances
+        if ftuple.Channels is None:
+            channel_res_abundances = accumulate_residue_abundances(protein_len, ftuple.Localizations[proteinID],
+                                                                   channel_abundances)
+        else:
+            channel_res_abundances = accumulate_matrix_residue_abundances(
+                protein_len, ftuple.Localizations[proteinID], row_channels, ftuple.Channels.Abundances,
+                len(abundance_col_titles))
+        # THIS IS ONE INDEXED. RESIDUE 1 IS IN INDEX 1 of the array. index 0 is UNUSED
+        # col. 0= mod abundance, col. 1=residue abundance
+        all_prot_abundances[res_abundance_col_title] = {
+            abundance_col_title: channel_res_abundances[channel]
+            for channel, abundance_col_title in enumerate(abundance_col_titles)}
 
     return all_prot_abundances
 
 
-def calc_peptide_mod_abundances(ftuple, mod_localization_col_titles, frag_localization_col_titles,
-                                abundance_col_titles, protein_seqrecords):
-    df = ftuple.FileData
-    fdata = df.fillna(0)
-
-    # group each peptide fragment by the sequence
-    grouped = fdata.groupby('stripped_sequence')
-    sample_frag_abundances = {}
-    for abund_col_title in abundance_col_titles:
-        abund_col_title = sanitize_str_for_dataframe_index(abund_col_title)
-        sample_prot_frag_abundances = {}
-        for prot_id in protein_seqrecords:
-            prot_frag_abundances = []
-            mod_col_title = mod_localization_col_titles[prot_id]
-            frag_loc_col_title = frag_localization_col_titles[prot_id]
-            for frags_same_seq in grouped:
-                # a dd all the abundances for fragments with the same sequence
-                frag_abundance = frags_same_seq[1][abund_col_title].sum()
-                # ID all the fragments with modifications
-                bools = []
-                for mods in frags_same_seq[1][mod_col_title]:
-                    if mods:
-                        if -1 not in mods:
-                            bools.append(True)
-                        else:
-                            bools.append(False)
-                    else:
-                        bools.append(False)
-                # add the abundances for all fragments with modifications
-                mod_abundance = frags_same_seq[1].loc[bools, abund_col_title].sum()
-                assert (mod_abundance <= frag_abundance)
-                frag_localization_tuple = frags_same_seq[1][frag_loc_col_title].iloc[0][0]
-                if -1 in frag_localization_tuple:
-                    prot_frag_abundances.append((frags_same_seq[0], -1, -1, mod_abundance,
-                                                 frag_abundance))
-                else:
-                    prot_frag_abundances.append((frags_same_seq[0], frag_localization_tuple[0],
-                                                 frag_localization_tuple[1], mod_abundance, frag_abundance))
-            sample_prot_frag_abundances.update({prot_id: prot_frag_abundances})
-        sample_frag_abundances.update({abund_col_title: sample_prot_frag_abundances})
-    return sample_frag_abundances
+def fragment_occurrences(localization: ProteinLocalization) -> \
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The occurrences of the fragments of a ProteinLocalization that get their abundance: only the first occurrence of
+    each fragment when it has no FragWeights, every occurrence otherwise
+    :param localization: the ProteinLocalization of the fragments in a protein
+    :return: a tuple of the offsets of the occurrences of the fragment in row Rows[i], occurrences[offsets[i]:offsets[i
+    + 1]], and the int64 one indexed, inclusive start and end and the share of the abundance (None when each gets all
+    of it) of each occurrence
+    """
+    if localization.FragWeights is None:
+        first_occurrences = localization.FragOffsets[:-1]
+        return np.arange(len(localization.Rows) + 1), localization.FragStarts[first_occurrences].astype(np.int64), \
+            localization.FragEnds[first_occurrences].astype(np.int64), None
+    return localization.FragOffsets, localization.FragStarts.astype(np.int64), \
+        localization.FragEnds.astype(np.int64), localization.FragWeights
 
 
-def ingest_file_data(files: List[str]) -> List[FileTuple]:
+def modification_placements(localization: ProteinLocalization) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Takes the list if files to ingest, reads them, and returns the data as
-    a list of tuples of the file name and a DataFrame of the file contents
-    :param files: a list of paths to input files
-    :return: a list containing 2-tuples of the filename and a dataframe of the file contents
+    Flattens the modifications of a ProteinLocalization into the (fragment, position, weight) they add the abundance
+    of the fragment to, placing the modifications of a fragment in each of its fragment_occurrences
+    :param localization: the ProteinLocalization of the fragments in a protein
+    :return: a tuple of the index into Rows of the fragment of each placed modification, its one indexed position in
+    the protein and its weight, the product of its site probability and the share of its occurrence. The weights are
+    None when every weight is 1
     """
-    data = []
-    # open each file
-    for input_file_path in files:
-        with open(input_file_path, mode='r') as infile:
-            # read the contents into a DataFrame
-            contents = pd.read_csv(infile, delimiter=',', skipinitialspace=True)
-            # sanitize the headers only- no spaces, all lowercase, no parenthesis for easier indexing
-            contents.columns = pd.Index([sanitize_str_for_dataframe_index(header) for header in contents.columns])
-            # let the DataFrame guess at its data types so everything isn't a str or some other object
-            contents.infer_objects()
-        # Add the file data to the list with its filename as a FileTuple object
-        data.append(FileTuple(infile, contents))
+    mod_counts = np.diff(localization.ModOffsets)
+    if localization.FragWeights is None:
+        return np.repeat(np.arange(len(localization.Rows)), mod_counts), localization.ModPositions, \
+            localization.ModWeights
+    # every modification of every occurrence, at the same offset from the start of the occurrence as from the first
+    occurrence_fragments = np.repeat(np.arange(len(localization.Rows)), np.diff(localization.FragOffsets))
+    occurrences, mods = expand_ranges(localization.ModOffsets[occurrence_fragments],
+                                      localization.ModOffsets[occurrence_fragments + 1] - 1)
+    fragments = occurrence_fragments[occurrences]
+    shifts = localization.FragStarts[occurrences].astype(np.int64) - \
+        localization.FragStarts[localization.FragOffsets[fragments]]
+    weights = localization.FragWeights[occurrences]
+    if localization.ModWeights is not None:
+        weights = weights * localization.ModWeights[mods]
+    return fragments, localization.ModPositions[mods] + shifts, weights
 
-    return data
+
+def row_fragment_occurrences(localization: ProteinLocalization, n_rows: int, rows: np.ndarray) -> \
+        List[Tuple[Tuple[int, int, float], ...]]:
+    """
+    The fragment_occurrences of some rows of a DataFrame as tuples
+    :param localization: the ProteinLocalization of the DataFrame's fragments in a protein
+    :param n_rows: the number of rows in the DataFrame
+    :param rows: the rows to get the occurrences of
+    :return: a tuple of the one indexed, inclusive (start, end, share of the abundance) of each occurrence of the
+    fragment of each row, a single (-1, -1, 1.0) where the fragment was not localized
+    """
+    occurrence_offsets, starts, ends, weights = fragment_occurrences(localization)
+    if weights is None:
+        weights = np.ones(len(starts))
+    fragments = np.full(n_rows, -1, dtype=np.int64)
+    fragments[localization.Rows] = np.arange(len(localization.Rows))
+    occurrences = []
+    for fragment in fragments[rows].tolist():
+        if fragment == -1:
+            occurrences.append(((-1, -1, 1.0),))
+            continue
+        occurrence = slice(occurrence_offsets[fragment], occurrence_offsets[fragment + 1])
+        occurrences.append(tuple(zip(starts[occurrence].tolist(), ends[occurrence].tolist(),
+                                     weights[occurrence].tolist())))
+    return occurrences
 
 
-def sanitize_str_for_dataframe_index(dirty_string):
-    # remove spaces, parenthesis, octothorpes so that it plays nicely as an index for DatFrames and Series objects
-    return dirty_string.strip().lower().replace(' ', '_').replace('(', '').replace(')', '').replace("#", "num")
+def modified_rows(localization: ProteinLocalization, n_rows: int) -> np.ndarray:
+    """
+    :return: a bool array marking the rows of a DataFrame with modifications localized in the protein of a
+    ProteinLocalization
+    """
+    modified = np.zeros(n_rows, dtype=bool)
+    modified[localization.Rows[np.diff(localization.ModOffsets) > 0]] = True
+    return modified
 
 
-def get_protein_sequences(fasta_files: List[str]) -> Dict:
+def expand_ranges(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Ingests the proteins sequences from a list of fasta files
-    :param fasta_files: the list of paths to fasta files to use in the alignment and localization
-    :return: a Dict mapping sequenceIDs to Bio.SeqRecord objects
+    Expands inclusive [start, end] ranges into the flattened (range number, position) pairs they cover, in range
+    order and ascending position within each range
+    :param starts: int array of the range starts
+    :param ends: int array of the inclusive range ends
+    :return: a tuple of the index of the range each position came from and the positions themselves
     """
-    # The ID and the SeqRecord
-    # somewhat redundant, as the SeqRecord already contains the ID in it
-    # TODO convert from tuple to just the SeqRecord?
-    protein_seq_records: Dict[str, SeqRecord] = dict()
-    for file in fasta_files:
-        with open(file, "r") as handle:
-            for sequence_record in SeqIO.parse(handle, "fasta"):
-                # add the SeqRecord to the Dict of SeqRecords
-                protein_seq_records.update({sequence_record.id: sequence_record})
+    lengths = ends - starts + 1
+    range_idx = np.repeat(np.arange(len(starts)), lengths)
+    # offset of each position from the start of its range
+    offsets = np.arange(len(range_idx)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return range_idx, starts[range_idx] + offsets
 
-    return protein_seq_records
 
+# the maximum number of (residue, channel) abundances expanded in memory at once when accumulating residue abundances
+RESIDUE_BATCH_SIZE: int = 1 << 22
 
-def output_residue_analysis_data(prot_id, fileid, abundance_array, output_directory, output_name_stub):
-    filename = output_directory + fileid + prot_id + output_name_stub + ".csv"
-    with open(filename, 'w') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerow(["Residue #:", "Modification Abundance", "Residue Abundance", "Modification Proportion"])
-        for i, arr in enumerate(abundance_array):
-            if (arr[0] != float('NaN')) and (arr[1] != 0) and (arr[1] != float('NaN')):
-                mod_prop = arr[0] / arr[1]
-                writer.writerow([i, arr[0], arr[1], mod_prop])
-            else:
-                writer.writerow([i, arr[0], arr[1], float("nan")])
-    return
 
+def accumulate_residue_abundances(protein_len: int, localization: ProteinLocalization, channel_abundances: np.ndarray,
+                                  res_abundances: np.ndarray = None) -> np.ndarray:
+    """
+    Calculates the modification and residue abundance arrays of one protein for every abundance channel at once.
+    The abundances are scattered with np.add.at in the same row order the fragments appear in the data, so the sums
+    (including NaN propagation) are identical to adding each fragment's abundance residue by residue
+    :param protein_len: the length of the protein the fragments are localized in
+    :param localization: the ProteinLocalization of the fragments in the protein, the abundance of each fragment is
+    added to its fragment_occurrences
+    :param channel_abundances: (rows, channels) array of the abundance of each fragment in each channel
+    :param res_abundances: abundance arrays from earlier rows to add these fragments to, a new array if None
+    :return: a (channels, protein_len + 1, 2) array, col. 0= mod abundance, col. 1=residue abundance
+    """
+    n_channels = channel_abundances.shape[1]
+    if res_abundances is None:
+        res_abundances = np.zeros((n_channels, protein_len + 1, 2), dtype=float)
+    # (protein_len + 1, channels) views of the modification and residue abundances
+    modified = res_abundances[:, :, 0].T
+    coverage = res_abundances[:, :, 1].T
 
-def output_peptide_analysis_data(prot_id, file_id, fragment_list, output_directory, peptide_output_name_stub):
-    filename = output_directory + file_id + prot_id + peptide_output_name_stub + ".csv"
-    with open(filename, 'w') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerow(["Fragment", "Start Position", "End Position", "Length", "Phosphorylation Abundance",
-                         "Fragment Abundance", "Modification Proportion"])
-        for i in fragment_list:
-            phos_abundance = i[3]
-            frag_abundance = i[4]
-            if (phos_abundance != float('NaN')) and (frag_abundance != 0) and (frag_abundance != float('NaN')):
-                mod_prop = phos_abundance / frag_abundance
-                writer.writerow([i[0], i[1], i[2], i[3], i[4], mod_prop])
-            else:
-                writer.writerow([i[0], i[1], i[2], i[3], i[4], float("nan")])
+    occurrence_offsets, starts, ends, weights = fragment_occurrences(localization)
+    # the row of each occurrence
+    localized_rows = np.repeat(localization.Rows, np.diff(occurrence_offsets))
+
+    # split the occurrences into batches so that the expanded residues of a batch stay under RESIDUE_BATCH_SIZE values
+    residues_covered = np.cumsum(ends - starts + 1)
+    batch_residues = max(RESIDUE_BATCH_SIZE // max(n_channels, 1), 1)
+    batch_bounds = np.searchsorted(residues_covered, np.arange(batch_residues, residues_covered[-1], batch_residues),
+                                   side='right') if len(residues_covered) else []
+    for batch in np.split(np.arange(len(localized_rows)), batch_bounds):
+        range_idx, residues = expand_ranges(starts[batch], ends[batch])
+        # add the abundance, or the occurrence's share of it, to the abundance of each residue in the fragment
+        batch_abundances = channel_abundances[localized_rows[batch][range_idx]]
+        if weights is not None:
+            batch_abundances *= weights[batch][range_idx, np.newaxis]
+        np.add.at(coverage, residues, batch_abundances)
+
+    # add the abundance to each modified residue contained in the fragment, weighted by its site probability and the
+    # share of the fragment's occurrence
+    mod_fragments, mod_positions, mod_weights = modification_placements(localization)
+    mod_abundances = channel_abundances[localization.Rows[mod_fragments]]
+    if mod_weights is not None:
+        mod_abundances *= mod_weights[:, np.newaxis]
+    np.add.at(modified, mod_positions, mod_abundances)
+
+    return res_abundances
+
+
+def matrix_row_channels(channels: ChannelMatrix, abundance_col_titles: List[str]) -> np.ndarray:
+    """
+    Maps the channel of each row of a ChannelMatrix to the abundance columns being calculated
+    :param channels: the ChannelMatrix
+    :param abundance_col_titles: the sanitized titles of the abundance columns being calculated
+    :return: the index in abundance_col_titles of the channel of each row, len(abundance_col_titles) for rows of a
+    channel that isn't being calculated
+    """
+    channel_columns = np.array([abundance_col_titles.index(title) if title in abundance_col_titles
+                                else len(abundance_col_titles) for title in channels.Titles], dtype=np.int64)
+    return channel_columns[channels.RowChannels]
+
+
+def accumulate_matrix_residue_abundances(protein_len: int, localization: ProteinLocalization, row_channels: np.ndarray,
+                                         abundances: np.ndarray, n_channels: int) -> np.ndarray:
+    """
+    accumulate_residue_abundances for the abundances of a ChannelMatrix, without expanding them to a (rows, channels)
+    matrix. Each row only adds its abundance to its own channel, and the residues and modifications it covers become
+    NaN in every other channel, just as adding its missing abundance in those channels would make them
+    :param protein_len: the length of the protein the fragments are localized in
+    :param localization: the ProteinLocalization of the fragments in the protein
+    :param row_channels: the channel of each row, rows of channel n_channels only make the other channels NaN
+    :param abundances: the abundance of each row in its channel
+    :param n_channels: the number of channels
+    :return: a (n_channels, protein_len + 1, 2) array, col. 0= mod abundance, col. 1=residue abundance
+    """
+    # the extra channel collects the rows of channels that aren't calculated
+    res_abundances = np.zeros((n_channels + 1, protein_len + 1, 2), dtype=float)
+    # the number of rows of each channel covering or modifying each residue
+    row_counts = np.zeros((n_channels + 1, protein_len + 1, 2), dtype=np.int64)
+
+    occurrence_offsets, starts, ends, weights = fragment_occurrences(localization)
+    # the row and channel of each occurrence
+    localized_rows = np.repeat(localization.Rows, np.diff(occurrence_offsets))
+    channels = row_channels[localized_rows]
+
+    # split the occurrences into batches so that the expanded residues of a batch stay under RESIDUE_BATCH_SIZE values
+    residues_covered = np.cumsum(ends - starts + 1)
+    batch_bounds = np.searchsorted(residues_covered, np.arange(RESIDUE_BATCH_SIZE, residues_covered[-1],
+                                                               RESIDUE_BATCH_SIZE),
+                                   side='right') if len(residues_covered) else []
+    for batch in np.split(np.arange(len(localized_rows)), batch_bounds):
+        range_idx, residues = expand_ranges(starts[batch], ends[batch])
+        # add the abundance, or the occurrence's share of it, to the abundance of each residue in the fragment, in its
+        # channel
+        batch_abundances = abundances[localized_rows[batch][range_idx]]
+        if weights is not None:
+            batch_abundances *= weights[batch][range_idx]
+        np.add.at(res_abundances[:, :, 1], (channels[batch][range_idx], residues), batch_abundances)
+        np.add.at(row_counts[:, :, 1], (channels[batch][range_idx], residues), 1)
+
+    # add the abundance to each modified residue contained in the fragment, weighted by its site probability and the
+    # share of the fragment's occurrence
+    mod_fragments, mod_positions, mod_weights = modification_placements(localization)
+    mod_rows = localization.Rows[mod_fragments]
+    mod_abundances = abundances[mod_rows]
+    if mod_weights is not None:
+        mod_abundances = mod_abundances * mod_weights
+    np.add.at(res_abundances[:, :, 0], (row_channels[mod_rows], mod_positions), mod_abundances)
+    np.add.at(row_counts[:, :, 0], (row_channels[mod_rows], mod_positions), 1)
+
+    # residues covered or modified by the rows of another channel
+    res_abundances[row_counts.sum(axis=0) > row_counts] = np.nan
+    return res_abundances[:n_channels]
+
+
+def calc_peptide_mod_abundances(ftuple, mod_localization_col_titles, frag_localization_col_titles,
+                                abundance_col_titles, protein_seqrecords):
+    """
+    Calculates, for each abundance column and protein, the abundance of each distinct peptide fragment and how much of
+    it is modified. Every abundance column is summed at once, and only the rows localized in a protein are visited for
+    that protein
+    :param ftuple: FileTuple containing the file ID, the DataFrame and the localizations of its fragments
+    :param mod_localization_col_titles: dict mapping protein ID to the title of its mod localizations
+    :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
+    :param abundance_col_titles: list of titles of the abundance columns of interest in the DataFrame
+    :param protein_seqrecords: the ProteinSequences, proteinID mapped to its sequence
+    :return: a dict mapping abundance column titles to a dict of proteinIDs mapped to a list of (fragment, start,
+    end, modification abundance, fragment abundance) tuples, one per distinct fragment in sorted order. The start and
+    end are -1 if the fragment isn't in the protein. When the abundance of a fragment is shared between its
+    occurrences, it has a tuple for each of its occurrences in the protein with that occurrence's share of the
+    abundances
+    """
+    fdata = ftuple.FileData
+    abundance_col_titles = [sanitize_str_for_dataframe_index(title) for title in abundance_col_titles]
+    n_channels = len(abundance_col_titles)
+    # group each peptide fragment by the sequence, the code of each row being its group
+    codes, sequences = pd.factorize(fdata['stripped_sequence'], sort=True)
+
+    # missing abundances count as 0
+    if ftuple.Channels is None:
+        # (channels, rows) matrix of the abundance columns
+        channel_abundances = np.stack([fdata[title].fillna(0).to_numpy() for title in abundance_col_titles]) \
+            if abundance_col_titles else np.zeros((0, len(fdata)))
+    else:
+        row_channels = matrix_row_channels(ftuple.Channels, abundance_col_titles)
+        row_abundances = np.nan_to_num(ftuple.Channels.Abundances, nan=0.0)[np.newaxis]
+
+    def group_abundances(rows):
+        # the (channels, groups) sums of the abundances of the rows of each group, the rows of a group being added in
+        # the order they appear in the data
+        if ftuple.Channels is None:
+            rows = rows[np.argsort(codes[rows], kind='stable')]
+            return segment_sums(channel_abundances[:, rows],
+                                csr_offsets(np.bincount(codes[rows], minlength=len(sequences))))
+        # a row only has an abundance in its own channel, so its abundance is added to the (channel, group) segment
+        rows = rows[row_channels[rows] < n_channels]
+        segments = row_channels[rows] * len(sequences) + codes[rows]
+        rows = rows[np.argsort(segments, kind='stable')]
+        return segment_sums(row_abundances[:, rows], csr_offsets(np.bincount(
+            segments, minlength=n_channels * len(sequences)))).reshape(n_channels, len(sequences))
+
+    # add all the abundances for fragments with the same sequence
+    frag_abundances = group_abundances(np.arange(len(fdata)))
+    # the fragment localization of each group is that of its first row
+    first_rows = np.zeros(len(fdata), dtype=bool)
+    first_rows[np.unique(codes, return_index=True)[1]] = True
+
+    sample_frag_abundances = {abund_col_title: {} for abund_col_title in abundance_col_titles}
+    # only the proteins the fragments were localized against, which are only the master proteins when using them
+    for prot_id in (prot_id for prot_id in protein_seqrecords if prot_id in ftuple.Localizations):
+        localization = ftuple.Localizations[prot_id]
+        # the occurrences of each group are those of its first row, a single -1, -1 one if the fragment isn't in the
+        # protein
+        occurrence_offsets, starts, ends, weights = fragment_occurrences(localization)
+        first_localized = np.flatnonzero(first_rows[localization.Rows])
+        localized_codes = codes[localization.Rows[first_localized]]
+        group_occurrences = np.ones(len(sequences), dtype=np.int64)
+        group_occurrences[localized_codes] = np.diff(occurrence_offsets)[first_localized]
+        group_offsets = csr_offsets(group_occurrences)
+        occurrence_indices = gather_segments(occurrence_offsets, first_localized)[1]
+        group_indices = expand_ranges(group_offsets[localized_codes], group_offsets[localized_codes + 1] - 1)[1]
+        frag_starts = np.full(group_offsets[-1], -1, dtype=np.int64)
+        frag_ends = np.full(group_offsets[-1], -1, dtype=np.int64)
+        frag_starts[group_indices] = starts[occurrence_indices]
+        frag_ends[group_indices] = ends[occurrence_indices]
+        # the group of each (fragment, start, end) tuple
+        groups = np.repeat(np.arange(len(sequences)), group_occurrences)
+
+        # add the abundances for all fragments with modifications, group by group
+        mod_abundances = group_abundances(localization.Rows[np.diff(localization.ModOffsets) > 0])
+        assert (mod_abundances <= frag_abundances).all()
+        occurrence_mod_abundances = mod_abundances[:, groups]
+        occurrence_frag_abundances = frag_abundances[:, groups]
+        if weights is not None:
+            # each occurrence's share of the abundances of its group
+            group_weights = np.ones(group_offsets[-1])
+            group_weights[group_indices] = weights[occurrence_indices]
+            occurrence_mod_abundances *= group_weights
+            occurrence_frag_abundances *= group_weights
+
+        group_sequences = sequences[groups] if weights is not None else sequences
+        frag_starts = frag_starts.tolist()
+        frag_ends = frag_ends.tolist()
+        for channel, abund_col_title in enumerate(abundance_col_titles):
+            sample_frag_abundances[abund_col_title][prot_id] = list(zip(
+                group_sequences, frag_starts, frag_ends, occurrence_mod_abundances[channel].tolist(),
+                occurrence_frag_abundances[channel].tolist()))
+    return sample_frag_abundances
+
+
+def segment_sums(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Sums each segment of every row of a 2d array. The segments of each length are stacked and summed in one reduction
+    along their contiguous last axis, which numpy sums pairwise the same way as a single segment, so the sums are
+    identical to summing every segment on its own
+    :param values: (channels, n) array of the values to sum
+    :param offsets: the offsets of the segments, segment s spanning offsets[s]:offsets[s + 1]
+    :return: (channels, segments) array of the sum of each segment in each channel, 0 for empty segments
+    """
+    lengths = np.diff(offsets)
+    sums = np.zeros((len(values), len(lengths)), dtype=values.dtype)
+    order = np.argsort(lengths, kind='stable')
+    for segments in np.split(order, np.flatnonzero(np.diff(lengths[order])) + 1):
+        length = int(lengths[segments[0]]) if len(segments) else 0
+        if not length:
+            continue
+        stacked = np.ascontiguousarray(values[:, offsets[segments][:, np.newaxis] + np.arange(length)])
+        sums[:, segments] = stacked.reshape(-1, length).sum(axis=1).reshape(len(values), len(segments))
+    return sums
+
+
+def calc_localized_abundances(localized_data: List[FileTuple], mod_localization_col_titles: Dict[str, str],
+                              frag_localization_col_titles: Dict[str, str], file_abundance_col_titles: List[List[str]],
+                              protein_seq_records: Dict, calculate_peptides: bool = True,
+                              profile: PipelineProfile = None) -> Tuple[List, List]:
+    """
+    Calculates the residue and modification abundances of each localized input against each protein
+    :param localized_data: FileTuples of the localized input files
+    :param mod_localization_col_titles: dict mapping protein ID to the title of its mod localizations
+    :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
+    :param file_abundance_col_titles: the titles of the abundance columns to calculate for each input
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param calculate_peptides: whether to calculate the peptide abundances
+    :param profile: the PipelineProfile to record the residue and peptide calculations of each input in, if any
+    :return: a tuple of the list of residue analyses and the list of peptide analyses (empty if not calculated) of
+    the input files
+    """
+    residue_analysis_all_prot = []
+    peptide_analysis_all_prot = []
+    for ftuple, abundance_col_titles in zip(localized_data, file_abundance_col_titles):
+        counts = {'rows': len(ftuple.FileData), 'proteins': len(ftuple.Localizations),
+                  'channels': len(ftuple.Channels.Titles if ftuple.Channels is not None else abundance_col_titles)}
+        # for residue modification analysis, calculate the amount each residue is modified
+        with profile_stage(profile, 'residue_abundances', **counts):
+            residue_analysis_all_prot.append(calc_residue_mod_abundances(ftuple, mod_localization_col_titles,
+                                                                         frag_localization_col_titles,
+                                                                         abundance_col_titles, protein_seq_records))
+        # for peptide modification analysis, calculate the amount each peptide fragment is modified
+        if calculate_peptides:
+            with profile_stage(profile, 'peptide_abundances', **counts):
+                peptide_analysis_all_prot.append(calc_peptide_mod_abundances(
+                    ftuple, mod_localization_col_titles, frag_localization_col_titles, abundance_col_titles,
+                    protein_seq_records))
+    return residue_analysis_all_prot, peptide_analysis_all_prot
+
+
+def fileid_channel_abundances(file_data: pd.DataFrame, fileid_col_name: str, abundance_col_name: str) -> \
+        Tuple[List[str], np.ndarray]:
+    """
+    Splits a single abundance column into one abundance channel per fileID, the same channels
+    convert_fileidtoabundaceformat creates. Rows get a NaN abundance in the channels of other fileIDs
+    :param file_data: DataFrame containing the fileID and abundance columns
+    :param fileid_col_name: sanitized title of the fileID column
+    :param abundance_col_name: title of the abundance column
+    :return: a tuple of the channel titles, ordered by fileID, and the (rows, channels) array of abundances
+    """
+    fileids = file_data[fileid_col_name]
+    abundances = file_data[sanitize_str_for_dataframe_index(abundance_col_name)].to_numpy(dtype=float)
+    channel_fileids = sorted(fileids.dropna().unique())
+    channel_titles = [sanitize_str_for_dataframe_index("Abundance:" + str(fileid)) for fileid in channel_fileids]
+    channel_abundances = np.full((len(file_data), len(channel_fileids)), np.nan)
+    for channel, fileid in enumerate(channel_fileids):
+        same_fileid = (fileids == fileid).to_numpy()
+        channel_abundances[same_fileid, channel] = abundances[same_fileid]
+    return channel_titles, channel_abundances
+
+
+def pad_rows(array: np.ndarray, n_rows: int) -> np.ndarray:
+    """
+    :return: a copy of a 2d array with zero rows added to the end so that it has n_rows rows
+    """
+    return np.pad(array, ((0, n_rows - len(array)), (0, 0)))
+
+
+class StreamingAccumulator:
+    """
+    Running residue and peptide abundances of one input file, which is added to chunk by chunk. Holds only the
+    abundance arrays and one entry per distinct peptide so memory does not grow with the number of rows. The residue
+    arrays are identical to calc_residue_mod_abundances on the whole file and the peptide tuples hold the same sums as
+    calc_peptide_mod_abundances
+    """
+
+    def __init__(self, protein_seq_records: Dict):
+        """
+        :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+        """
+        self.protein_lens: Dict[str, int] = {prot_id: len(protein) for prot_id, protein in protein_seq_records.items()}
+        self.channel_titles: List[str] = []
+        # residue abundance title mapped to a (channels + 1, protein_len + 1, 2) array. Channel 0 counts the fragments
+        # covering and modifying each residue so channels first seen in a later chunk know which residues earlier
+        # fragments of other fileIDs made NaN
+        self.res_abundances: Dict[str, np.ndarray] = {}
+        # distinct stripped sequence mapped to its row in the peptide arrays
+        self.peptide_ids: Dict[str, int] = {}
+        # proteinID mapped to the (start, end, share of the abundance) of each fragment_occurrences of each peptide,
+        # a single (-1, -1, 1.0) for peptides not in the protein
+        self.peptide_localizations: Dict[str, List[Tuple[Tuple[int, int, float], ...]]] = {}
+        # (peptides, channels) fragment abundances and proteinID mapped to the (peptides, channels) modified abundances
+        self.peptide_abundances = np.zeros((0, 0), dtype=float)
+        self.peptide_mod_abundances: Dict[str, np.ndarray] = {}
+
+    def add_channels(self, channel_titles: List[str]):
+        """
+        Adds abundance channels that have not been seen yet. Residues already covered by other channels' fragments are
+        NaN in the new channels, as they would be if the new channel's column had been NaN for those fragments
+        :param channel_titles: the titles of the channels in the next chunk
+        """
+        new_titles = [title for title in channel_titles if title not in self.channel_titles]
+        if not new_titles:
+            return
+        self.channel_titles.extend(new_titles)
+        for res_title, res_abundances in self.res_abundances.items():
+            new_channels = np.where(res_abundances[0] > 0, np.nan, 0.0)
+            self.res_abundances[res_title] = np.concatenate(
+                (res_abundances, np.repeat(new_channels[np.newaxis], len(new_titles), axis=0)))
+        padding = ((0, 0), (0, len(new_titles)))
+        self.peptide_abundances = np.pad(self.peptide_abundances, padding)
+        for prot_id, mod_abundances in self.peptide_mod_abundances.items():
+            self.peptide_mod_abundances[prot_id] = np.pad(mod_abundances, padding)
+
+    def add_peptides(self, file_data: pd.DataFrame, localizations: Dict[str, ProteinLocalization]) -> np.ndarray:
+        """
+        Gives every distinct stripped sequence in a chunk a row in the peptide arrays, recording the fragment
+        localization of the sequences seen for the first time
+        :param file_data: DataFrame of the localized chunk
+        :param localizations: dict mapping proteinID to the ProteinLocalization of the chunk's fragments
+        :return: the peptide array row of each row of the chunk
+        """
+        codes, sequences = pd.factorize(file_data['stripped_sequence'])
+        first_rows = np.unique(codes, return_index=True)[1]
+        new_codes = [code for code, sequence in enumerate(sequences) if sequence not in self.peptide_ids]
+        for code in new_codes:
+            self.peptide_ids[sequences[code]] = len(self.peptide_ids)
+        for prot_id, localization in localizations.items():
+            self.peptide_localizations.setdefault(prot_id, []).extend(
+                row_fragment_occurrences(localization, len(file_data), first_rows[new_codes]))
+
+        # the peptide arrays grow by doubling so adding peptides doesn't copy them every chunk
+        n_peptides = len(self.peptide_ids)
+        if n_peptides > len(self.peptide_abundances):
+            capacity = max(n_peptides, 2 * len(self.peptide_abundances))
+            self.peptide_abundances = pad_rows(self.peptide_abundances, capacity)
+            for prot_id, mod_abundances in self.peptide_mod_abundances.items():
+                self.peptide_mod_abundances[prot_id] = pad_rows(mod_abundances, capacity)
+        for prot_id in localizations:
+            self.peptide_mod_abundances.setdefault(prot_id, np.zeros_like(self.peptide_abundances))
+        return np.array([self.peptide_ids[sequence] for sequence in sequences], dtype=np.int64)[codes]
+
+    def add_chunk(self, ftuple: FileTuple, mod_localization_col_titles: Dict[str, str],
+                  frag_localization_col_titles: Dict[str, str], channel_titles: List[str],
+                  channel_abundances: np.ndarray, profile: PipelineProfile = None):
+        """
+        Adds the abundances of a localized chunk of the input file
+        :param ftuple: FileTuple containing the chunk and the localizations of its fragments
+        :param mod_localization_col_titles: dict mapping protein ID to the title of its mod localizations
+        :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
+        :param channel_titles: titles of the abundance channels in channel_abundances
+        :param channel_abundances: (rows, channels) array of the abundance of each fragment in each channel
+        :param profile: the PipelineProfile to record the residue and peptide accumulation of the chunk in, if any
+        """
+        fdata = ftuple.FileData
+        self.add_channels(channel_titles)
+        # lay the chunk's channels out in the accumulator's channel order, channels missing from the chunk are NaN for
+        # its rows, which is what they are when the whole file is converted at once
+        chunk_abundances = np.full((len(fdata), len(self.channel_titles)), np.nan)
+        chunk_abundances[:, [self.channel_titles.index(title) for title in channel_titles]] = channel_abundances
+
+        counts = {'rows': len(fdata), 'proteins': len(ftuple.Localizations), 'channels': len(channel_titles)}
+        # residue abundances, with the fragment count in channel 0
+        with profile_stage(profile, 'residue_abundances', **counts):
+            counted_abundances = np.column_stack((np.ones(len(fdata)), chunk_abundances))
+            for proteinID, mod_column_title in mod_localization_col_titles.items():
+                res_abundance_col_title = mod_column_title.replace('_mod_localization', '')
+                self.res_abundances[res_abundance_col_title] = accumulate_residue_abundances(
+                    self.protein_lens[proteinID], ftuple.Localizations[proteinID], counted_abundances,
+                    self.res_abundances.get(res_abundance_col_title))
+
+        # peptide abundances, which treat missing abundances as 0
+        with profile_stage(profile, 'peptide_abundances', **counts):
+            peptide_rows = self.add_peptides(fdata, ftuple.Localizations)
+            peptide_abundances = np.nan_to_num(chunk_abundances, nan=0.0)
+            np.add.at(self.peptide_abundances, peptide_rows, peptide_abundances)
+            for proteinID, localization in ftuple.Localizations.items():
+                # fragments with modifications localized in the protein
+                modified = modified_rows(localization, len(fdata))
+                np.add.at(self.peptide_mod_abundances[proteinID], peptide_rows[modified],
+                          peptide_abundances[modified])
+
+    def residue_analysis(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        :return: the residue abundances in the format of calc_residue_mod_abundances
+        """
+        return {res_title: {title: res_abundances[channel + 1] for channel, title in enumerate(self.channel_titles)}
+                for res_title, res_abundances in self.res_abundances.items()}
+
+    def peptide_analysis(self) -> Dict[str, Dict[str, List[Tuple]]]:
+        """
+        :return: the peptide abundances in the format of calc_peptide_mod_abundances
+        """
+        # the peptide arrays can have spare rows at the end, only the rows of the peptides seen are used
+        sequences = sorted(self.peptide_ids)
+        rows = [self.peptide_ids[sequence] for sequence in sequences]
+        sample_frag_abundances = {}
+        for channel, title in enumerate(self.channel_titles):
+            frag_abundances = self.peptide_abundances[rows, channel]
+            sample_frag_abundances[title] = {
+                prot_id: [(sequence, start, end, mod_abundance * weight, frag_abundance * weight)
+                          for sequence, row, mod_abundance, frag_abundance in
+                          zip(sequences, rows, self.peptide_mod_abundances[prot_id][rows, channel], frag_abundances)
+                          for start, end, weight in localizations[row]]
+                for prot_id, localizations in self.peptide_localizations.items()}
+        return sample_frag_abundances
+
+
+# Put in a pipeline queue after its last item
+PIPELINE_END = object()
+# Seconds a pipeline thread waits on a full or empty queue before checking whether the pipeline has stopped
+PIPELINE_POLL_SECONDS: float = 0.1
+
+
+def put_until_stopped(items: queue.Queue, item, stopped: Callable[[], bool]) -> bool:
+    """
+    Puts an item in a bounded queue, waiting for room for as long as the pipeline hasn't stopped
+    :return: whether the item was put
+    """
+    while not stopped():
+        try:
+            items.put(item, timeout=PIPELINE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def prefetch(items: Iterator, depth: int) -> Iterator:
+    """
+    Iterates over items in a reader thread, so the next items are produced while the current one is being used. At
+    most depth items are produced ahead, which bounds the memory they take up. An error producing an item is raised
+    when the item would have been
+    :param items: the items, produced in the reader thread
+    :param depth: the number of items to produce ahead of the one being used
+    :return: an iterator of the items
+    """
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if not put_until_stopped(results, (item, None), stop.is_set):
+                    return
+            put_until_stopped(results, (PIPELINE_END, None), stop.is_set)
+        except BaseException as error:
+            put_until_stopped(results, (PIPELINE_END, error), stop.is_set)
+
+    reader = threading.Thread(target=produce, name="prefetch", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item, error = results.get()
+            if error is not None:
+                raise error
+            if item is PIPELINE_END:
+                return
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+class BackgroundWriter:
+    """
+    Runs a write function in a writer thread on the items put to it, so they are written while the next items are
+    being made. At most depth items wait to be written, put blocks until there is room so memory stays bounded when
+    writing falls behind
+    """
+
+    def __init__(self, write: Callable[[Iterator], None], depth: int):
+        """
+        :param write: writes every item of the iterator it is called with, in the writer thread
+        :param depth: the number of items that can wait to be written
+        """
+        self.items = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.error: BaseException = None
+        self.writer = threading.Thread(target=self.run, args=(write,), name="writer", daemon=True)
+        self.writer.start()
+
+    def run(self, write: Callable[[Iterator], None]):
+        try:
+            write(self.queued_items())
+        except BaseException as error:
+            self.error = error
+        finally:
+            self.stop.set()
+
+    def queued_items(self) -> Iterator:
+        while not self.stop.is_set():
+            try:
+                item = self.items.get(timeout=PIPELINE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if item is PIPELINE_END:
+                return
+            yield item
+
+    def put(self, item):
+        """
+        Queues an item to be written, raising the error of the writer if it has failed
+        """
+        if not put_until_stopped(self.items, item, self.stop.is_set):
+            self.close()
+
+    def close(self):
+        """
+        Waits for every queued item to be written, raising the error of the writer if it has failed
+        """
+        put_until_stopped(self.items, PIPELINE_END, self.stop.is_set)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        """
+        Stops the writer without writing the items still queued
+        """
+        self.stop.set()
+        self.writer.join()
+
+
+def run_pipeline(items: Iterator, depth: int, read: Callable, analyze: Callable,
+                 writes: List[Callable[[Iterator], None]]):
+    """
+    Reads, analyzes and writes items as a pipeline. Each item is read in a reader thread and analyzed in this thread,
+    and every analysis is written by each write function in its own writer thread, so up to depth items are read
+    ahead of and written behind the one being analyzed
+    :param items: the items to read, analyze and write, in order
+    :param depth: the number of items each queue between the reader, this thread and the writers holds
+    :param read: called with an item, returns what analyze is called with
+    :param analyze: called with an item and what was read for it, returns the analysis to write
+    :param writes: functions writing every analysis of the iterator they are called with, in the order of the items
+    """
+    writers = [BackgroundWriter(write, depth) for write in writes]
+    try:
+        for item, contents in prefetch(((item, read(item)) for item in items), depth):
+            analysis = analyze(item, contents)
+            for writer in writers:
+                writer.put(analysis)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    for writer in writers:
+        writer.close()
+
+
+def stream_file_analysis(input_file_path: str, chunk_size: int, protein_seq_records: Dict, mod_regex: str,
+                         abundance_col_titles: List[str], fileid_col_name: str = None,
+                         protein_index: ProteinIndex = None,
+                         master_localization: Tuple[Dict[str, str], str] = None,
+                         profile: PipelineProfile = None, prefetch_depth: int = 0,
+                         multiple_localizations: str = 'first') -> StreamingAccumulator:
+    """
+    Reads, localizes and accumulates an input file chunk by chunk
+    :param input_file_path: path to the input file
+    :param chunk_size: the number of rows to read at a time
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param mod_regex: The regex string to use to parse out the modifications from the modifications column
+    :param abundance_col_titles: titles of the abundance columns. If using a fileID column only the first is used
+    :param fileid_col_name: title of the fileID column to split the abundance into channels by, None to use the
+    abundance columns as the channels
+    :param protein_index: the ProteinIndex to align the fragments with when not using the master protein
+    :param master_localization: a tuple of the dict mapping the name of each master protein to its fasta ID and the
+    position in master regex to localize using the master protein positions and modifications, None to align against
+    the proteins instead
+    :param profile: the PipelineProfile to record the stages of each chunk in, if any
+    :param prefetch_depth: the number of chunks to read ahead in a reader thread while the current chunk is localized
+    and accumulated, 0 to read each chunk when it is needed
+    :param multiple_localizations: how the abundance of a fragment localized more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: a StreamingAccumulator holding the residue and peptide abundances of the file
+    """
+    accumulator = StreamingAccumulator(protein_seq_records)
+    chunks = ingest_file_chunks(input_file_path, chunk_size)
+    if prefetch_depth:
+        chunks = prefetch(chunks, prefetch_depth)
+    while True:
+        with profile_stage(profile, 'ingest') as counts:
+            ftuple = next(chunks, None)
+            counts['rows'] = len(ftuple.FileData) if ftuple is not None else 0
+        if ftuple is None:
+            break
+        with profile_stage(profile, 'raw_sequences', rows=len(ftuple.FileData)):
+            ftuple = gen_raw_sequences(ftuple)
+        if fileid_col_name is not None:
+            # rows without a fileID don't belong to any channel
+            fileid_col_title = sanitize_str_for_dataframe_index(fileid_col_name)
+            ftuple = FileTuple(ftuple.FileName, ftuple.FileData[ftuple.FileData[fileid_col_title].notna()])
+        with profile_stage(profile, 'localization', rows=len(ftuple.FileData)) as counts:
+            localized_ftuple, mod_loc_col_titles, frag_loc_col_titles = localize_fragments(
+                ftuple, protein_seq_records, mod_regex, protein_index, master_localization, multiple_localizations)
+            counts['proteins'] = len(localized_ftuple.Localizations)
+        if fileid_col_name is not None:
+            with profile_stage(profile, 'fileid_conversion', rows=len(localized_ftuple.FileData)) as counts:
+                channel_titles, channel_abundances = fileid_channel_abundances(
+                    localized_ftuple.FileData, fileid_col_title, abundance_col_titles[0])
+                counts['channels'] = len(channel_titles)
+        else:
+            channel_titles = [sanitize_str_for_dataframe_index(title) for title in abundance_col_titles]
+            channel_abundances = localized_ftuple.FileData[channel_titles].to_numpy(dtype=float)
+        accumulator.add_chunk(localized_ftuple, mod_loc_col_titles, frag_loc_col_titles, channel_titles,
+                              channel_abundances, profile)
+    return accumulator
+
+
+# SharedArray describes a numpy array copied into a shared memory block, so worker processes can attach to it instead
+# of having the array pickled to them
+SharedArray = namedtuple("SharedArray", ['Name', 'DType', 'Shape'])
+# SharedColumn describes a DataFrame column placed in shared memory. Numeric columns are stored as Values, string
+# columns as the Values codes of each row into the distinct strings, which are stored as the utf-8 Strings split at
+# Offsets. Missing strings have a code of -1
+SharedColumn = namedtuple("SharedColumn", ['Title', 'Values', 'Strings', 'Offsets'])
+
+
+def share_array(array: np.ndarray, blocks: List[shared_memory.SharedMemory]) -> SharedArray:
+    """
+    Copies an array into a new shared memory block
+    :param array: the array to share
+    :param blocks: list the new shared memory block is added to, so the caller can unlink it once the workers are done
+    :return: a SharedArray describing the shared copy of the array
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return SharedArray(Name=block.name, DType=array.dtype.str, Shape=array.shape)
+
+
+def attach_array(shared: SharedArray, blocks: List[shared_memory.SharedMemory]) -> np.ndarray:
+    """
+    Attaches to an array shared by share_array without copying it
+    :param shared: the SharedArray describing the array
+    :param blocks: list the attached shared memory block is added to, the array is only valid until it is closed
+    :return: the array, backed by the shared memory block
+    """
+    block = shared_memory.SharedMemory(name=shared.Name)
+    blocks.append(block)
+    return np.ndarray(shared.Shape, dtype=np.dtype(shared.DType), buffer=block.buf)
+
+
+def share_columns(file_data: pd.DataFrame, titles: List[str], blocks: List[shared_memory.SharedMemory]) -> \
+        List[SharedColumn]:
+    """
+    Places columns of a DataFrame in shared memory
+    :param file_data: the DataFrame to share the columns of
+    :param titles: the titles of the columns to share
+    :param blocks: list the new shared memory blocks are added to
+    :return: a list of SharedColumns describing the shared columns
+    """
+    shared_columns = []
+    for title in titles:
+        column = file_data[title]
+        if pd.api.types.is_numeric_dtype(column):
+            shared_columns.append(SharedColumn(title, share_array(column.to_numpy(dtype=float), blocks), None, None))
+        else:
+            codes, strings = pd.factorize(column)
+            encoded = [str(string).encode('utf-8') for string in strings]
+            offsets = np.cumsum([0] + [len(string) for string in encoded], dtype=np.int64)
+            shared_columns.append(SharedColumn(title, share_array(codes, blocks),
+                                               share_array(np.frombuffer(b''.join(encoded), dtype=np.uint8), blocks),
+                                               share_array(offsets, blocks)))
+    return shared_columns
+
+
+def attach_columns(shared_columns: List[SharedColumn]) -> pd.DataFrame:
+    """
+    Rebuilds a DataFrame from columns shared by share_columns
+    :param shared_columns: the SharedColumns describing the columns
+    :return: a DataFrame with a copy of the shared columns
+    """
+    blocks = []
+    columns = {}
+    try:
+        for shared_column in shared_columns:
+            values = attach_array(shared_column.Values, blocks)
+            if shared_column.Strings is None:
+                columns[shared_column.Title] = values.copy()
+            else:
+                raw = attach_array(shared_column.Strings, blocks).tobytes()
+                offsets = attach_array(shared_column.Offsets, blocks)
+                # the extra NaN at the end is picked by the -1 code of missing strings
+                strings = np.array([raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+                                   + [np.nan], dtype=object)
+                columns[shared_column.Title] = strings[values]
+        return pd.DataFrame(columns)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def share_protein_index(protein_index: ProteinIndex, blocks: List[shared_memory.SharedMemory]) -> ProteinIndex:
+    """
+    Places the sequence and suffix array of a ProteinIndex in shared memory. The ProteinIndex of a FASTA store is not
+    copied, the workers memory map the store themselves
+    :param protein_index: the ProteinIndex to share
+    :param blocks: list the new shared memory blocks are added to
+    :return: a ProteinIndex with SharedArrays in place of the Sequence and SuffixArray, None for the ProteinIndex of a
+    FASTA store
+    """
+    if isinstance(protein_index.Sequence, mmap.mmap) or isinstance(protein_index.SuffixArray, np.memmap):
+        return None
+    return protein_index._replace(Sequence=share_array(np.frombuffer(protein_index.Sequence, dtype=np.uint8), blocks),
+                                  SuffixArray=share_array(protein_index.SuffixArray, blocks))
+
+
+# Set in each worker process of the process pool by init_worker
+worker_protein_seq_records: Mapping = {}
+worker_protein_index: ProteinIndex = None
+# shared memory blocks the worker's protein index is attached to, kept open for the life of the worker
+worker_shared_blocks: List[shared_memory.SharedMemory] = []
+
+
+def init_worker(protein_seq_records: Mapping, shared_protein_index: ProteinIndex):
+    """
+    Sets up a worker process of the process pool with the proteins to localize against
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param shared_protein_index: a ProteinIndex shared by share_protein_index, None when using the master protein or a
+    FASTA store
+    """
+    global worker_protein_seq_records, worker_protein_index
+    worker_protein_seq_records = protein_seq_records
+    if shared_protein_index is not None:
+        worker_protein_index = shared_protein_index._replace(
+            Sequence=attach_array(shared_protein_index.Sequence, worker_shared_blocks).tobytes(),
+            SuffixArray=attach_array(shared_protein_index.SuffixArray, worker_shared_blocks))
+    elif getattr(protein_seq_records, 'store_directory', None) is not None:
+        worker_protein_index = build_protein_index(protein_seq_records)  # the saved index of the store
+
+
+def analyze_protein_batch(shared_columns: List[SharedColumn], shared_channels: ChannelMatrix, protein_ids: List[str],
+                          mod_regex: str, abundance_col_titles: List[str],
+                          master_localization: Tuple[Dict[str, str], str], calculate_peptides: bool,
+                          multiple_localizations: str = 'first') -> Tuple[Dict, Dict]:
+    """
+    Worker process task localizing an input file against a batch of the proteins and calculating the residue and
+    peptide abundances in those proteins
+    :param shared_columns: the columns of the input file needed for the analysis, shared by share_columns
+    :param shared_channels: the ChannelMatrix of the input file with SharedArrays in place of its arrays, None if the
+    abundance channels are among the shared columns
+    :param protein_ids: the IDs of the proteins in the batch
+    :param mod_regex: The regex string to use to parse out the modifications from the modifications column
+    :param abundance_col_titles: list of titles of the abundance columns of interest in the DataFrame
+    :param master_localization: a tuple of the dict mapping the name of each master protein to its fasta ID and the
+    position in master regex to localize using the master protein positions and modifications, None to align against
+    the proteins instead
+    :param calculate_peptides: whether to calculate the peptide abundances
+    :param multiple_localizations: how the abundance of a fragment localized more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: a tuple of the residue analysis and peptide analysis (None if not calculated) of the batch
+    """
+    protein_seq_records = {prot_id: worker_protein_seq_records[prot_id] for prot_id in protein_ids}
+    ftuple = FileTuple(None, attach_columns(shared_columns))
+    if shared_channels is not None:
+        blocks = []
+        try:
+            ftuple = ftuple._replace(Channels=shared_channels._replace(
+                RowChannels=attach_array(shared_channels.RowChannels, blocks).copy(),
+                Abundances=attach_array(shared_channels.Abundances, blocks).copy()))
+        finally:
+            for block in blocks:
+                block.close()
+    localized_ftuple, mod_loc_col_titles, frag_loc_col_titles = localize_fragments(
+        ftuple, protein_seq_records, mod_regex, worker_protein_index, master_localization, multiple_localizations)
+    residue_analysis = calc_residue_mod_abundances(localized_ftuple, mod_loc_col_titles, frag_loc_col_titles,
+                                                   abundance_col_titles, protein_seq_records)
+    peptide_analysis = calc_peptide_mod_abundances(localized_ftuple, mod_loc_col_titles, frag_loc_col_titles,
+                                                   abundance_col_titles, protein_seq_records) \
+        if calculate_peptides else None
+    return residue_analysis, peptide_analysis
+
+
+def parallel_file_analysis(data: List[FileTuple], workers: int, protein_seq_records: Dict, mod_regex: str,
+                           file_abundance_col_titles: List[List[str]], protein_index: ProteinIndex = None,
+                           master_localization: Tuple[Dict[str, str], str] = None, calculate_peptides: bool = True,
+                           multiple_localizations: str = 'first') -> List[Tuple[Dict, Dict]]:
+    """
+    Localizes the input files and calculates their residue and peptide abundances in a pool of worker processes, one
+    task per input file and batch of proteins. The columns the tasks need are passed through shared memory rather
+    than pickling the DataFrames, and the batches are merged in protein order so the results are the same as
+    localizing and calculating each file in this process
+    :param data: FileTuples of the input files, with raw sequences and abundance channels
+    :param workers: the number of worker processes
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param mod_regex: The regex string to use to parse out the modifications from the modifications column
+    :param file_abundance_col_titles: the titles of the abundance columns to calculate for each input file
+    :param protein_index: the ProteinIndex to align the fragments with when not using the master protein
+    :param master_localization: a tuple of the dict mapping the name of each master protein to its fasta ID and the
+    position in master regex to localize using the master protein positions and modifications, None to align against
+    the proteins instead
+    :param calculate_peptides: whether to calculate the peptide abundances
+    :param multiple_localizations: how the abundance of a fragment localized more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: a list of the residue analysis and peptide analysis (None if not calculated) of each input file
+    """
+    if master_localization is not None:
+        # everything is localized against the master protein, so there is only one batch per file
+        protein_batches = [list(protein_seq_records)]
+        localization_col_titles = ['stripped_sequence', 'modifications_in_master_proteins',
+                                   'positions_in_master_proteins']
+    else:
+        # a few batches per worker so that uneven batches still keep every worker busy
+        protein_batches = [batch.tolist() for batch in
+                           np.array_split(np.array(list(protein_seq_records), dtype=object),
+                                          min(workers * 4, len(protein_seq_records))) if len(batch)]
+        localization_col_titles = ['stripped_sequence', 'modifications']
+
+    blocks: List[shared_memory.SharedMemory] = []
+    try:
+        shared_index = share_protein_index(protein_index, blocks) if protein_index is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(protein_seq_records, shared_index)) as executor:
+            # submit every file's batches up front so the workers move straight on to the next file
+            file_futures = []
+            for ftuple, abundance_col_titles in zip(data, file_abundance_col_titles):
+                abundance_col_titles = [sanitize_str_for_dataframe_index(title) for title in abundance_col_titles]
+                if ftuple.Channels is None:
+                    shared_columns = share_columns(ftuple.FileData, localization_col_titles + abundance_col_titles,
+                                                   blocks)
+                    shared_channels = None
+                else:
+                    shared_columns = share_columns(ftuple.FileData, localization_col_titles, blocks)
+                    shared_channels = ftuple.Channels._replace(
+                        RowChannels=share_array(ftuple.Channels.RowChannels, blocks),
+                        Abundances=share_array(ftuple.Channels.Abundances, blocks))
+                file_futures.append([executor.submit(analyze_protein_batch, shared_columns, shared_channels, batch,
+                                                     mod_regex, abundance_col_titles, master_localization,
+                                                     calculate_peptides, multiple_localizations)
+                                     for batch in protein_batches])
+
+            file_analyses = []
+            for batch_futures in file_futures:
+                residue_analysis: Dict[str, Dict] = {}
+                peptide_analysis: Dict[str, Dict] = {} if calculate_peptides else None
+                for future in batch_futures:
+                    batch_residue_analysis, batch_peptide_analysis = future.result()
+                    residue_analysis.update(batch_residue_analysis)
+                    if calculate_peptides:
+                        for abund_col_title, prot_frag_abundances in batch_peptide_analysis.items():
+                            peptide_analysis.setdefault(abund_col_title, {}).update(prot_frag_abundances)
+                file_analyses.append((residue_analysis, peptide_analysis))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return file_analyses
+
+
+def stream_file_analysis_worker(input_file_path: str, chunk_size: int, mod_regex: str,
+                                abundance_col_titles: List[str], fileid_col_name: str = None,
+                                master_localization: Tuple[Dict[str, str], str] = None,
+                                multiple_localizations: str = 'first') -> StreamingAccumulator:
+    """
+    Worker process task running stream_file_analysis on one input file with the worker's proteins
+    """
+    return stream_file_analysis(input_file_path, chunk_size, worker_protein_seq_records, mod_regex,
+                                abundance_col_titles, fileid_col_name, worker_protein_index, master_localization,
+                                multiple_localizations=multiple_localizations)
+
+
+def parallel_stream_analysis(input_files: List[str], workers: int, chunk_size: int, protein_seq_records: Dict,
+                             mod_regex: str, abundance_col_titles: List[str], fileid_col_name: str = None,
+                             protein_index: ProteinIndex = None,
+                             master_localization: Tuple[Dict[str, str], str] = None,
+                             multiple_localizations: str = 'first') -> List[StreamingAccumulator]:
+    """
+    Streams each input file through stream_file_analysis in a pool of worker processes. Each worker reads its own
+    file, so only the accumulated abundances are sent back
+    :param input_files: paths to the input files
+    :param workers: the number of worker processes
+    :param chunk_size: the number of rows to read at a time
+    :param protein_seq_records: the ProteinSequences, proteinID mapped to its sequence
+    :param mod_regex: The regex string to use to parse out the modifications from the modifications column
+    :param abundance_col_titles: titles of the abundance columns. If using a fileID column only the first is used
+    :param fileid_col_name: title of the fileID column to split the abundance into channels by, None to use the
+    abundance columns as the channels
+    :param protein_index: the ProteinIndex to align the fragments with when not using the master protein
+    :param master_localization: a tuple of the dict mapping the name of each master protein to its fasta ID and the
+    position in master regex to localize using the master protein positions and modifications, None to align against
+    the proteins instead
+    :param multiple_localizations: how the abundance of a fragment localized more than once is shared, one of
+    MULTIPLE_LOCALIZATIONS
+    :return: a StreamingAccumulator for each input file, in input file order
+    """
+    blocks: List[shared_memory.SharedMemory] = []
+    try:
+        shared_index = share_protein_index(protein_index, blocks) if protein_index is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(protein_seq_records, shared_index)) as executor:
+            return list(executor.map(stream_file_analysis_worker, input_files, repeat(chunk_size), repeat(mod_regex),
+                                     repeat(abundance_col_titles), repeat(fileid_col_name),
+                                     repeat(master_localization), repeat(multiple_localizations)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def ingest_file_data(files: List[str]) -> List[FileTuple]:
+    """
+    Takes the list if files to ingest, reads them, and returns the data as
+    a list of tuples of the file name and a DataFrame of the file contents
+    :param files: a list of paths to input files
+    :return: a list containing 2-tuples of the filename and a dataframe of the file contents
+    """
+    data = []
+    # open each file
+    for input_file_path in files:
+        if columnar_format(input_file_path) is not None:
+            # Parquet and Arrow files are already typed
+            infile = input_file_path
+            contents = next(read_columnar_batches(input_file_path))
+        else:
+            with open(input_file_path, mode='r') as infile:
+                # read the contents into a DataFrame
+                contents = pd.read_csv(infile, delimiter=',', skipinitialspace=True)
+                # let the DataFrame guess at its data types so everything isn't a str or some other object
+                contents.infer_objects()
+        # sanitize the headers only- no spaces, all lowercase, no parenthesis for easier indexing
+        contents.columns = pd.Index([sanitize_str_for_dataframe_index(header) for header in contents.columns])
+        # Add the file data to the list with its filename as a FileTuple object
+        data.append(FileTuple(infile, contents))
+
+    return data
+
+
+def read_input_file(input_file_path: str, abundance_col_titles: List[str],
+                    fileid_col_name: str = None) -> Tuple[FileTuple, List[str]]:
+    """
+    Reads an input file and gets it ready to be localized, the way every input file is before localization when they
+    are read all at once
+    :param input_file_path: path to the input file
+    :param abundance_col_titles: titles of the abundance columns. If using a fileID column only the first is used
+    :param fileid_col_name: title of the fileID column to split the abundance into channels by, None to use the
+    abundance columns as the channels
+    :return: a tuple of the FileTuple with the raw sequence of each fragment, and the titles of its abundance columns
+    """
+    ftuple = gen_raw_sequences(ingest_file_data(files=[input_file_path])[0])
+    if fileid_col_name is None:
+        return ftuple, abundance_col_titles
+    file_abundance_col_titles, ftuple = convert_fileidtoabundaceformat(
+        ftuple, sanitize_str_for_dataframe_index(fileid_col_name), abundance_col_titles[0])
+    return ftuple, file_abundance_col_titles
+
+
+def ingest_file_chunks(input_file_path: str, chunk_size: int) -> Iterator[FileTuple]:
+    """
+    Reads an input file a chunk of rows at a time
+    :param input_file_path: path to the input file
+    :param chunk_size: the number of rows in each chunk
+    :return: a generator of FileTuples of the filename and a DataFrame of the next chunk_size rows of the file
+    """
+    if columnar_format(input_file_path) is not None:
+        for contents in read_columnar_batches(input_file_path, chunk_size):
+            contents.columns = pd.Index([sanitize_str_for_dataframe_index(header) for header in contents.columns])
+            yield FileTuple(input_file_path, contents)
+        return
+    with open(input_file_path, mode='r') as infile:
+        for contents in pd.read_csv(infile, delimiter=',', skipinitialspace=True, chunksize=chunk_size):
+            # sanitize the headers only- no spaces, all lowercase, no parenthesis for easier indexing
+            contents.columns = pd.Index([sanitize_str_for_dataframe_index(header) for header in contents.columns])
+            yield FileTuple(infile, contents)
+
+
+# Input files with these extensions are read as columnar (Parquet or Arrow IPC/Feather) tables instead of csv
+COLUMNAR_FORMATS: Dict[str, str] = {'.parquet': 'parquet', '.feather': 'ipc', '.arrow': 'ipc'}
+
+# Key of the localization metadata in the schema metadata of a saved localized DataFrame
+LOCALIZATION_METADATA_KEY: bytes = b'abundanceparser.localization'
+
+# Titles of the columns a ChannelMatrix is saved in, its RowChannels and Abundances
+CHANNEL_COLUMN_TITLES: Tuple[str, str] = ("channels.row_channels", "channels.abundances")
+
+
+def columnar_format(input_file_path: str) -> str:
+    """
+    :return: the pyarrow dataset format of a columnar input file, None if the file is csv
+    """
+    return COLUMNAR_FORMATS.get(os.path.splitext(input_file_path)[1].lower())
+
+
+def read_columnar_batches(input_file_path: str, batch_size: int = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a Parquet or Arrow IPC file a batch of rows at a time
+    :param input_file_path: path to the file
+    :param batch_size: the maximum number of rows in each batch, None to read the whole file in one DataFrame
+    :return: a generator of DataFrames of the rows of the file
+    """
+    import pyarrow.dataset
+
+    dataset = pyarrow.dataset.dataset(input_file_path, format=columnar_format(input_file_path))
+    if batch_size is None:
+        yield dataset.to_table().to_pandas()
+        return
+    for batch in dataset.to_batches(batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+def localized_output_path(input_file_path: str, output_directory: str) -> str:
+    """
+    :return: the path the localized DataFrame of an input file is saved to
+    """
+    return output_directory + os.path.splitext(os.path.basename(input_file_path))[0] + ".localized.arrow"
+
+
+def save_localized_data(ftuple: FileTuple, mod_localization_col_titles: Dict[str, str],
+                        frag_localization_col_titles: Dict[str, str], abundance_col_titles: List[str],
+                        path: str):
+    """
+    Saves a localized DataFrame as an uncompressed Arrow IPC file, which later runs can memory map with
+    load_localized_files instead of localizing the input again. The localizations of each protein are stored as list
+    columns holding the fragment starts, fragment ends and modification positions of every row, and the FragWeights
+    and ModWeights in ".weights" list columns when the localization has them. A ChannelMatrix is stored in the
+    CHANNEL_COLUMN_TITLES columns, and the localization column titles, abundance column titles and channel titles are
+    kept in the file's schema metadata
+    :param ftuple: FileTuple containing the localized DataFrame, its localizations and ChannelMatrix if it has one
+    :param mod_localization_col_titles: dict mapping protein ID to the title of its mod localizations
+    :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
+    :param abundance_col_titles: list of titles of the abundance columns of interest in the DataFrame
+    :param path: path to save the file to
+    """
+    import pyarrow
+    import pyarrow.feather
+
+    n_rows = len(ftuple.FileData)
+    table = pyarrow.Table.from_pandas(ftuple.FileData, preserve_index=False)
+    for prot_id, localization in ftuple.Localizations.items():
+        # the offsets of the rows the protein's arrays skip are repeated, giving those rows empty lists
+        frag_offsets = row_offsets(localization.Rows, localization.FragOffsets, n_rows)
+        mod_offsets = row_offsets(localization.Rows, localization.ModOffsets, n_rows)
+        frag_loc_col_title = frag_localization_col_titles[prot_id]
+        table = table.append_column(frag_loc_col_title + ".starts",
+                                    pyarrow.LargeListArray.from_arrays(frag_offsets, localization.FragStarts))
+        table = table.append_column(frag_loc_col_title + ".ends",
+                                    pyarrow.LargeListArray.from_arrays(frag_offsets, localization.FragEnds))
+        table = table.append_column(mod_localization_col_titles[prot_id],
+                                    pyarrow.LargeListArray.from_arrays(mod_offsets, localization.ModPositions))
+        if localization.FragWeights is not None:
+            table = table.append_column(frag_loc_col_title + ".weights",
+                                        pyarrow.LargeListArray.from_arrays(frag_offsets, localization.FragWeights))
+        if localization.ModWeights is not None:
+            table = table.append_column(mod_localization_col_titles[prot_id] + ".weights",
+                                        pyarrow.LargeListArray.from_arrays(mod_offsets, localization.ModWeights))
+    if ftuple.Channels is not None:
+        table = table.append_column(CHANNEL_COLUMN_TITLES[0], pyarrow.array(ftuple.Channels.RowChannels))
+        table = table.append_column(CHANNEL_COLUMN_TITLES[1], pyarrow.array(ftuple.Channels.Abundances))
+    metadata = json.dumps({'mod_localization_col_titles': mod_localization_col_titles,
+                           'frag_localization_col_titles': frag_localization_col_titles,
+                           'abundance_col_titles': abundance_col_titles,
+                           'channel_titles': ftuple.Channels.Titles if ftuple.Channels is not None else None})
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), LOCALIZATION_METADATA_KEY: metadata})
+    pyarrow.feather.write_feather(table, path, compression='uncompressed')
+
+
+def row_offsets(rows: np.ndarray, offsets: np.ndarray, n_rows: int) -> np.ndarray:
+    """
+    :return: the offsets of a CSR style array over only some rows of a DataFrame, spread out over every row of it.
+    The rows left out have empty segments
+    """
+    lengths = np.zeros(n_rows, dtype=np.int64)
+    lengths[rows] = np.diff(offsets)
+    return csr_offsets(lengths)
+
+
+def load_localized_files(paths: List[str]) -> Tuple[List[FileTuple], Dict[str, str], Dict[str, str], List[str]]:
+    """
+    Loads localized DataFrames saved by save_localized_data. The files are memory mapped, so the numeric columns and
+    the localization positions are read without copying
+    :param paths: paths to the saved files
+    :return: a tuple of the localized FileTuples, the dict mapping proteinID to mod localization title, the
+    dict mapping proteinID to fragment localization title and the abundance column titles
+    """
+    import pyarrow
+    import pyarrow.feather
+
+    def list_column(table, title):
+        # the offsets and values of a list column, the offsets starting at 0
+        column = table.column(title).combine_chunks()
+        offsets = column.offsets.to_numpy()
+        return offsets - offsets[0], column.flatten().to_numpy()
+
+    localized_data = []
+    mod_localization_col_titles: Dict[str, str] = {}
+    frag_localization_col_titles: Dict[str, str] = {}
+    abundance_col_titles: List[str] = []
+    for path in paths:
+        table = pyarrow.feather.read_table(path, memory_map=True)
+        metadata = json.loads(table.schema.metadata[LOCALIZATION_METADATA_KEY])
+        mod_localization_col_titles.update(metadata['mod_localization_col_titles'])
+        frag_localization_col_titles.update(metadata['frag_localization_col_titles'])
+        abundance_col_titles.extend(title for title in metadata['abundance_col_titles']
+                                    if title not in abundance_col_titles)
+        localizations = {}
+        localization_titles = []
+        for prot_id, frag_loc_col_title in metadata['frag_localization_col_titles'].items():
+            mod_loc_col_title = metadata['mod_localization_col_titles'][prot_id]
+            frag_offsets, frag_starts = list_column(table, frag_loc_col_title + ".starts")
+            frag_ends = list_column(table, frag_loc_col_title + ".ends")[1]
+            mod_offsets, mod_positions = list_column(table, mod_loc_col_title)
+            localization_titles.extend((frag_loc_col_title + ".starts", frag_loc_col_title + ".ends",
+                                        mod_loc_col_title))
+            # the weights are only saved for localizations that have them
+            weights = {}
+            for weights_field, weights_title in (('FragWeights', frag_loc_col_title + ".weights"),
+                                                 ('ModWeights', mod_loc_col_title + ".weights")):
+                if weights_title in table.column_names:
+                    weights[weights_field] = list_column(table, weights_title)[1]
+                    localization_titles.append(weights_title)
+            # only the rows with a fragment localization are kept in the ProteinLocalization
+            rows = np.flatnonzero(np.diff(frag_offsets) > 0)
+            localizations[prot_id] = ProteinLocalization(
+                Rows=rows, FragOffsets=csr_offsets(np.diff(frag_offsets)[rows]), FragStarts=frag_starts,
+                FragEnds=frag_ends, ModOffsets=csr_offsets(np.diff(mod_offsets)[rows]), ModPositions=mod_positions,
+                **weights)
+        channels = None
+        if metadata.get('channel_titles') is not None:
+            channels = ChannelMatrix(Titles=metadata['channel_titles'],
+                                     RowChannels=table.column(CHANNEL_COLUMN_TITLES[0]).to_numpy(),
+                                     Abundances=table.column(CHANNEL_COLUMN_TITLES[1]).to_numpy())
+            localization_titles.extend(CHANNEL_COLUMN_TITLES)
+        localized_data.append(FileTuple(path, table.drop_columns(localization_titles).to_pandas(), localizations,
+                                        channels))
+    return localized_data, mod_localization_col_titles, frag_localization_col_titles, abundance_col_titles
+
+
+# Bumped whenever the localization or the way it is saved changes, so entries cached by older versions are not used
+LOCALIZATION_CACHE_VERSION: int = 4
+
+
+def file_digest(path: str) -> str:
+    """
+    :return: the sha256 hex digest of the contents of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def localization_cache_key(input_file_path: str, fasta_digests: List[str], localization_settings: Dict,
+                           version: int = LOCALIZATION_CACHE_VERSION) -> str:
+    """
+    Content address of the localization of an input file. Changing the input file, any of the FASTA files or any of the
+    localization settings gives a different key, so stale cache entries are never used
+    :param input_file_path: path to the input file
+    :param fasta_digests: the file_digest of each FASTA file the input is localized against
+    :param localization_settings: the settings the localization depends on, e.g. the regexes, must be json serializable
+    :param version: the version of the format the entries are saved in
+    :return: the cache key
+    """
+    key = hashlib.sha256()
+    key.update(json.dumps({'version': version, 'input': file_digest(input_file_path),
+                           'fasta': fasta_digests, 'settings': localization_settings}, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def lookup_localization_cache(cache_directory: str, key: str) -> str:
+    """
+    Looks a localization up in the cache, marking it as recently used
+    :param cache_directory: the directory of the cache
+    :param key: the localization_cache_key of the localization
+    :return: the path of the cached localized DataFrame, None if it isn't cached
+    """
+    path = os.path.join(cache_directory, key + ".localized.arrow")
+    if not os.path.isfile(path):
+        return None
+    os.utime(path)  # the eviction order is least recently used first
+    return path
+
+
+def store_localization_cache(cache_directory: str, key: str, ftuple: FileTuple,
+                             mod_localization_col_titles: Dict[str, str], frag_localization_col_titles: Dict[str, str],
+                             abundance_col_titles: List[str], max_size: int):
+    """
+    Saves a localized DataFrame in the cache, then evicts the least recently used entries until the cache is no larger
+    than max_size
+    :param cache_directory: the directory of the cache
+    :param key: the localization_cache_key of the localization
+    :param ftuple: FileTuple containing the localized DataFrame
+    :param mod_localization_col_titles: dict mapping protein ID to the title of its mod localizations
+    :param frag_localization_col_titles: dict mapping proteinID to the title of its fragment localizations
+    :param abundance_col_titles: list of titles of the abundance columns of interest in the DataFrame
+    :param max_size: the size in bytes to keep the cache under
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    path = os.path.join(cache_directory, key + ".localized.arrow")
+    # written under a temporary name and renamed so a concurrent run never loads a partly written entry
+    partial_path = path + ".{}.partial".format(os.getpid())
+    save_localized_data(ftuple, mod_localization_col_titles, frag_localization_col_titles, abundance_col_titles,
+                        partial_path)
+    os.replace(partial_path, path)
+    evict_localization_cache(cache_directory, max_size)
+
+
+def evict_localization_cache(cache_directory: str, max_size: int):
+    """
+    Deletes the least recently used cache entries until the cache is no larger than max_size
+    :param cache_directory: the directory of the cache
+    :param max_size: the size in bytes to keep the cache under
+    """
+    entries = []
+    for entry in os.scandir(cache_directory):
+        if entry.is_file() and entry.name.endswith(".localized.arrow"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    cache_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if cache_size <= max_size:
+            break
+        os.remove(path)
+        cache_size -= size
+
+
+# Version of the format analyses are saved in the incremental state in. Part of the analysis state key, so bumping it
+# makes every input be analyzed again
+ANALYSIS_STATE_VERSION: int = 1
+
+
+def analysis_state_paths(state_directory: str, key: str) -> Tuple[str, str]:
+    """
+    :return: the paths of the residue and the peptide analysis saved in the incremental state under key
+    """
+    return (os.path.join(state_directory, key + ".residues.arrow"),
+            os.path.join(state_directory, key + ".peptides.arrow"))
+
+
+def store_analysis_state(state_directory: str, key: str, residue_analysis: Dict[str, Dict[str, np.ndarray]],
+                         peptide_analysis: Dict[str, Dict[str, List[Tuple]]] = None):
+    """
+    Saves the residue and peptide analysis of an input file in the incremental state. Each is saved as an Arrow IPC
+    table of the arrays or tuples of every (protein, abundance column) pair one after the other, with the keys and
+    length of each pair in the metadata
+    :param state_directory: the directory of the incremental state
+    :param key: the analysis state key of the input file
+    :param residue_analysis: the residue analysis, as returned by calc_residue_mod_abundances
+    :param peptide_analysis: the peptide analysis, as returned by calc_peptide_mod_abundances, None if not calculated
+    """
+    import pyarrow
+    import pyarrow.feather
+
+    os.makedirs(state_directory, exist_ok=True)
+    residue_path, peptide_path = analysis_state_paths(state_directory, key)
+    # written under temporary names and renamed, the residue table last, so an entry is only ever seen whole
+    partial_suffix = ".{}.partial".format(os.getpid())
+    if peptide_analysis is not None:
+        blocks = [(file_id, prot_id, len(fragment_list)) for file_id, prot_analysis in peptide_analysis.items()
+                  for prot_id, fragment_list in prot_analysis.items()]
+        fragments = [fragment for prot_analysis in peptide_analysis.values()
+                     for fragment_list in prot_analysis.values() for fragment in fragment_list]
+        columns = list(zip(*fragments)) if fragments else [[]] * 5
+        table = pyarrow.table({'fragment': pyarrow.array(columns[0], type=pyarrow.string()),
+                               'start_position': pyarrow.array(columns[1], type=pyarrow.int64()),
+                               'end_position': pyarrow.array(columns[2], type=pyarrow.int64()),
+                               'modification_abundance': pyarrow.array(columns[3], type=pyarrow.float64()),
+                               'fragment_abundance': pyarrow.array(columns[4], type=pyarrow.float64())})
+        pyarrow.feather.write_feather(table.replace_schema_metadata({'blocks': json.dumps(blocks)}),
+                                      peptide_path + partial_suffix)
+        os.replace(peptide_path + partial_suffix, peptide_path)
+    elif os.path.exists(peptide_path):
+        os.remove(peptide_path)
+
+    blocks = [(prot_id, file_id, len(abundance_array)) for prot_id, sample_analysis in residue_analysis.items()
+              for file_id, abundance_array in sample_analysis.items()]
+    abundances = np.concatenate([abundance_array for sample_analysis in residue_analysis.values()
+                                 for abundance_array in sample_analysis.values()]) if blocks else np.zeros((0, 2))
+    table = pyarrow.table({'modification_abundance': abundances[:, 0], 'residue_abundance': abundances[:, 1]})
+    pyarrow.feather.write_feather(table.replace_schema_metadata({'blocks': json.dumps(blocks)}),
+                                  residue_path + partial_suffix)
+    os.replace(residue_path + partial_suffix, residue_path)
+
+
+def load_analysis_state(state_directory: str, key: str) -> Tuple[Dict[str, Dict[str, np.ndarray]],
+                                                                 Dict[str, Dict[str, List[Tuple]]]]:
+    """
+    Loads the residue and peptide analysis of an input file saved by store_analysis_state
+    :param state_directory: the directory of the incremental state
+    :param key: the analysis state key of the input file
+    :return: a tuple of the residue analysis and the peptide analysis (None if it wasn't saved), None if there is no
+    analysis saved under key
+    """
+    import pyarrow.feather
+
+    residue_path, peptide_path = analysis_state_paths(state_directory, key)
+    if not os.path.isfile(residue_path):
+        return None
+    table = pyarrow.feather.read_table(residue_path)
+    abundances = np.column_stack((table['modification_abundance'].to_numpy(),
+                                  table['residue_abundance'].to_numpy()))
+    residue_analysis: Dict[str, Dict[str, np.ndarray]] = {}
+    blocks = json.loads(table.schema.metadata[b'blocks'])
+    offsets = csr_offsets([length for _, _, length in blocks])
+    for (prot_id, file_id, _), start, end in zip(blocks, offsets[:-1], offsets[1:]):
+        residue_analysis.setdefault(prot_id, {})[file_id] = abundances[start:end]
+
+    if not os.path.isfile(peptide_path):
+        return residue_analysis, None
+    table = pyarrow.feather.read_table(peptide_path)
+    fragments = list(zip(*(table[title].to_pylist() for title in table.column_names)))
+    peptide_analysis: Dict[str, Dict[str, List[Tuple]]] = {}
+    blocks = json.loads(table.schema.metadata[b'blocks'])
+    offsets = csr_offsets([length for _, _, length in blocks])
+    for (file_id, prot_id, _), start, end in zip(blocks, offsets[:-1], offsets[1:]):
+        peptide_analysis.setdefault(file_id, {})[prot_id] = fragments[start:end]
+    return residue_analysis, peptide_analysis
+
+
+def prune_analysis_state(state_directory: str, keys: List[str]):
+    """
+    Deletes the analyses in the incremental state of input files that are no longer analyzed, or whose contents or
+    settings have changed
+    :param state_directory: the directory of the incremental state
+    :param keys: the analysis state keys of the input files of the run
+    """
+    kept = {path for key in keys for path in analysis_state_paths(state_directory, key)}
+    for entry in os.scandir(state_directory):
+        if entry.is_file() and entry.name.endswith((".residues.arrow", ".peptides.arrow")) and entry.path not in kept:
+            os.remove(entry.path)
+
+
+def residue_analysis_table(input_file_path: str, prot_residue_analysis: Dict[str, Dict[str, np.ndarray]]) -> \
+        pd.DataFrame:
+    """
+    Lays out the residue analysis of an input file as a long format table with a row per protein, abundance column and
+    residue
+    :param input_file_path: the input file the analysis is of
+    :param prot_residue_analysis: the residue analysis, as returned by calc_residue_mod_abundances
+    :return: the table of the residue analysis
+    """
+    prot_ids = []
+    file_ids = []
+    abundance_arrays = []
+    for prot_id, sample_analysis in prot_residue_analysis.items():
+        for file_id, abundance_array in sample_analysis.items():
+            prot_ids.append(prot_id)
+            file_ids.append(file_id)
+            abundance_arrays.append(abundance_array)
+    if not abundance_arrays:
+        return pd.DataFrame()
+    # the arrays of every protein and abundance column one after the other, with the residue numbers of each
+    lengths = np.array([len(abundance_array) for abundance_array in abundance_arrays])
+    abundances = np.concatenate(abundance_arrays)
+    residues = np.arange(len(abundances)) - np.repeat(csr_offsets(lengths)[:-1], lengths)
+    return pd.DataFrame({'input_file': input_file_path,
+                         'protein': np.repeat(np.array(prot_ids, dtype=object), lengths),
+                         'abundance_column': np.repeat(np.array(file_ids, dtype=object), lengths),
+                         'residue': residues,
+                         'modification_abundance': abundances[:, 0],
+                         'residue_abundance': abundances[:, 1],
+                         'modification_proportion': modification_proportions(abundances[:, 0], abundances[:, 1])})
+
+
+def peptide_analysis_table(input_file_path: str, prot_peptide_analysis: Dict[str, Dict[str, List[Tuple]]]) -> \
+        pd.DataFrame:
+    """
+    Lays out the peptide analysis of an input file as a long format table with a row per abundance column, protein and
+    fragment
+    :param input_file_path: the input file the analysis is of
+    :param prot_peptide_analysis: the peptide analysis, as returned by calc_peptide_mod_abundances
+    :return: the table of the peptide analysis
+    """
+    file_ids = []
+    prot_ids = []
+    fragment_lists = []
+    for file_id, prot_analysis in prot_peptide_analysis.items():
+        for prot_id, fragment_list in prot_analysis.items():
+            file_ids.append(file_id)
+            prot_ids.append(prot_id)
+            fragment_lists.append(fragment_list)
+    if not fragment_lists:
+        return pd.DataFrame()
+    lengths = np.array([len(fragment_list) for fragment_list in fragment_lists])
+    fragments = pd.DataFrame([fragment for fragment_list in fragment_lists for fragment in fragment_list],
+                             columns=['fragment', 'start_position', 'end_position', 'modification_abundance',
+                                      'fragment_abundance'])
+    fragments.insert(0, 'input_file', input_file_path)
+    fragments.insert(1, 'abundance_column', np.repeat(np.array(file_ids, dtype=object), lengths))
+    fragments.insert(2, 'protein', np.repeat(np.array(prot_ids, dtype=object), lengths))
+    fragments.insert(6, 'length', np.where(fragments['start_position'] != -1,
+                                           fragments['end_position'] - fragments['start_position'] + 1, -1))
+    fragments['modification_proportion'] = modification_proportions(
+        fragments['modification_abundance'].to_numpy(dtype=float),
+        fragments['fragment_abundance'].to_numpy(dtype=float))
+    return fragments
+
+
+def modification_proportions(mod_abundances: np.ndarray, abundances: np.ndarray) -> np.ndarray:
+    """
+    :return: the proportion of each abundance that is modified, NaN where the abundance is 0 or either is NaN
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(abundances != 0, mod_abundances / abundances, np.nan)
+
+
+def output_analysis_tables(input_files: List[str], residue_analysis_all_prot: List[Dict],
+                           peptide_analysis_all_prot: List[Dict], output_directory: str, residue_output_name_stub: str,
+                           peptide_output_name_stub: str = None, output_format: str = 'parquet',
+                           compression: str = ''):
+    """
+    Writes the residue analyses of every input file to one long format table, and the peptide analyses to another.
+    The tables are laid out and written a batch of rows at a time
+    :param input_files: the input file of each analysis
+    :param residue_analysis_all_prot: the residue analysis of each input file
+    :param peptide_analysis_all_prot: the peptide analysis of each input file
+    :param output_directory: the directory to write the tables to
+    :param residue_output_name_stub: the name of the residue table
+    :param peptide_output_name_stub: the name of the peptide table, None to not write it
+    :param output_format: "parquet" to write Parquet tables, "long_csv" to write CSV tables
+    :param compression: the Parquet compression codec, or "gzip", "bz2", "zstd" or "lz4" to compress the CSV tables.
+    Empty for the Parquet default of snappy, or uncompressed CSV
+    """
+    tables = [(residue_output_name_stub, residue_analysis_table, residue_analysis_all_prot)]
+    if peptide_output_name_stub is not None:
+        tables.append((peptide_output_name_stub, peptide_analysis_table, peptide_analysis_all_prot))
+    for output_name_stub, analysis_table, analysis_all_prot in tables:
+        output_analysis_table(output_directory + output_name_stub, analysis_table, zip(input_files, analysis_all_prot),
+                              output_format, compression)
+
+
+def output_analysis_table(output_path_stub: str, analysis_table: Callable, file_analyses: Iterator[Tuple[str, Dict]],
+                          output_format: str = 'parquet', compression: str = ''):
+    """
+    Writes the residue or peptide analyses of the input files to one long format table, a batch of rows at a time
+    :param output_path_stub: the path of the table without its extension
+    :param analysis_table: residue_analysis_table or peptide_analysis_table
+    :param file_analyses: the input file and the residue or peptide analysis of each input file, only iterated over as
+    the table is written
+    :param output_format: "parquet" to write a Parquet table, "long_csv" to write a CSV table
+    :param compression: the Parquet compression codec, or "gzip", "bz2", "zstd" or "lz4" to compress the CSV table.
+    Empty for the Parquet default of snappy, or uncompressed CSV
+    """
+    batches = (batch for input_file_path, analysis in file_analyses
+               for batch in analysis_table_batches(input_file_path, analysis, analysis_table))
+    if output_format == 'parquet':
+        write_parquet_tables(output_path_stub + ".parquet", batches, compression or 'snappy')
+    else:
+        write_csv_tables(output_path_stub + ".csv", batches, compression)
+
+
+def output_analysis_csvs(residue_analysis_all_prot: List[Dict], peptide_analysis_all_prot: List[Dict],
+                         output_directory: str, residue_output_name_stub: str, peptide_output_name_stub: str = None):
+    """
+    Writes a csv of each protein and abundance column of the residue and peptide analyses of the input files
+    :param residue_analysis_all_prot: the residue analysis of each input file
+    :param peptide_analysis_all_prot: the peptide analysis of each input file, empty when not calculated
+    :param output_directory: the directory to write the csvs to
+    :param residue_output_name_stub: appended to the names of the residue csvs
+    :param peptide_output_name_stub: appended to the names of the peptide csvs
+    """
+    for prot_residue_analysis in residue_analysis_all_prot:
+        for prot_id, sample_analysis in prot_residue_analysis.items():
+            for file_id, abundance_array in sample_analysis.items():
+                output_residue_analysis_data(prot_id, file_id, abundance_array, output_directory,
+                                             residue_output_name_stub)
+
+    for prot_peptide_analysis in peptide_analysis_all_prot:
+        for file_id, prot_analysis in prot_peptide_analysis.items():
+            for prot_id, fragment_list in prot_analysis.items():
+                output_peptide_analysis_data(prot_id, file_id, fragment_list, output_directory,
+                                             peptide_output_name_stub)
+
+
+# Rows of the long format output tables laid out in memory at a time
+OUTPUT_BATCH_ROWS: int = 1 << 20
+
+
+def analysis_table_batches(input_file_path: str, analysis: Dict[str, Dict], analysis_table: Callable,
+                           batch_rows: int = OUTPUT_BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Lays out a residue or peptide analysis as long format tables of whole proteins (residue analysis) or abundance
+    columns (peptide analysis) of about batch_rows rows each, in the row order of a single table of the analysis
+    :param input_file_path: the input file the analysis is of
+    :param analysis: the residue or peptide analysis
+    :param analysis_table: residue_analysis_table or peptide_analysis_table
+    :param batch_rows: the number of rows to collect before laying out a table
+    :return: an iterator of the tables
+    """
+    batch = {}
+    n_rows = 0
+    for key, entries in analysis.items():
+        batch[key] = entries
+        n_rows += sum(len(rows) for rows in entries.values())
+        if n_rows >= batch_rows:
+            yield analysis_table(input_file_path, batch)
+            batch = {}
+            n_rows = 0
+    if batch:
+        yield analysis_table(input_file_path, batch)
+
+
+def write_parquet_tables(path: str, tables: Iterator[pd.DataFrame], compression: str = 'snappy'):
+    """
+    Writes tables with the same columns one after the other as a single Parquet file, holding one table in memory at a
+    time
+    :param path: path of the Parquet file
+    :param tables: the tables, empty tables are skipped. The columns have the types of the first table
+    :param compression: the Parquet compression codec
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    writer = None
+    try:
+        for table in tables:
+            if not len(table.columns):
+                continue
+            arrow_table = pyarrow.Table.from_pandas(table, preserve_index=False,
+                                                    schema=writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, arrow_table.schema, compression=compression)
+            writer.write_table(arrow_table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pd.DataFrame().to_parquet(path, index=False, compression=compression)
+
+
+# File extension of each compression of the long format CSV tables
+CSV_COMPRESSIONS: Dict[str, str] = {'gzip': '.gz', 'bz2': '.bz2', 'zstd': '.zst', 'lz4': '.lz4'}
+# Write buffer of the CSV output files, so each file is written in large blocks
+OUTPUT_BUFFER_SIZE: int = 1 << 20
+
+
+def write_csv_tables(path: str, tables: Iterator[pd.DataFrame], compression: str = ''):
+    """
+    Writes tables with the same columns one after the other as a single CSV file, holding one table in memory at a
+    time. Missing values are written as empty fields
+    :param path: path of the CSV file, the extension of the compression is added to it
+    :param tables: the tables, empty tables are skipped. The columns have the types of the first table
+    :param compression: "gzip", "bz2", "zstd" or "lz4" to compress the file, empty to not compress it
+    """
+    import pyarrow
+    import pyarrow.csv
+
+    if compression and compression not in CSV_COMPRESSIONS:
+        raise ValueError("Unsupported CSV compression {}, expected one of {}".format(
+            compression, ", ".join(CSV_COMPRESSIONS)))
+    with pyarrow.output_stream(path + CSV_COMPRESSIONS.get(compression, ''), compression=compression or None,
+                               buffer_size=OUTPUT_BUFFER_SIZE) as outfile:
+        writer = None
+        schema = None
+        for table in tables:
+            if not len(table.columns):
+                continue
+            arrow_table = pyarrow.Table.from_pandas(table, preserve_index=False, schema=schema)
+            if writer is None:
+                schema = arrow_table.schema
+                writer = pyarrow.csv.CSVWriter(outfile, schema)
+            writer.write_table(arrow_table)
+        if writer is not None:
+            writer.close()
+
+
+def sanitize_str_for_dataframe_index(dirty_string):
+    # remove spaces, parenthesis, octothorpes so that it plays nicely as an index for DatFrames and Series objects
+    return dirty_string.strip().lower().replace(' ', '_').replace('(', '').replace(')', '').replace("#", "num")
+
+
+class ProteinSequences(Mapping):
+    """
+    The protein sequences of the FASTA files as uppercased bytes, keyed by proteinID in FASTA order. The sequences are
+    kept end to end, separated by PROTEIN_SEPARATOR, the same way a ProteinIndex concatenates them, and a protein's
+    sequence is only sliced out when it is looked up. Sequences opened from a FASTA store are memory mapped, so only the
+    parts of the store that are used are read
+    """
+
+    def __init__(self, sequence, protein_ids: List[str], protein_offsets: np.ndarray, protein_lens: np.ndarray,
+                 suffix_array: np.ndarray = None, store_directory: str = None):
+        """
+        :param sequence: the concatenated sequences, bytes or a memory map of them
+        :param protein_ids: the ID of each protein in concatenation order
+        :param protein_offsets: the start of each protein in sequence
+        :param protein_lens: the length of each protein
+        :param suffix_array: the suffix array of sequence, when opened from a FASTA store or already indexed
+        :param store_directory: the FASTA store the sequences were opened from, None when read from the FASTA files
+        """
+        self.sequence = sequence
+        self.protein_ids = protein_ids
+        self.protein_offsets = protein_offsets
+        self.protein_lens = protein_lens
+        self.suffix_array = suffix_array
+        self.store_directory = store_directory
+        self.protein_nums: Dict[str, int] = {prot_id: num for num, prot_id in enumerate(protein_ids)}
+
+    def __getitem__(self, prot_id: str) -> bytes:
+        num = self.protein_nums[prot_id]
+        start = int(self.protein_offsets[num])
+        return self.sequence[start:start + int(self.protein_lens[num])]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.protein_ids)
+
+    def __len__(self) -> int:
+        return len(self.protein_ids)
+
+    def __reduce__(self):
+        # memory maps can't be pickled, so worker processes open the FASTA store again instead
+        if self.store_directory is not None:
+            return open_protein_store, (self.store_directory,)
+        return ProteinSequences, (self.sequence, self.protein_ids, self.protein_offsets, self.protein_lens)
+
+
+def get_protein_sequences(fasta_files: List[str]) -> ProteinSequences:
+    """
+    Ingests the proteins sequences from a list of fasta files
+    :param fasta_files: the list of paths to fasta files to use in the alignment and localization
+    :return: the ProteinSequences of the fasta files. A protein with the same ID as an earlier one replaces its sequence
+    """
+    from Bio import SeqIO  # only needed when the FASTA files are read, not when a FASTA store is opened
+
+    sequences: Dict[str, bytes] = dict()
+    for file in fasta_files:
+        with open(file, "r") as handle:
+            for sequence_record in SeqIO.parse(handle, "fasta"):
+                sequences[sequence_record.id] = str(sequence_record.seq).upper().encode('ascii')
+
+    protein_lens = np.array([len(seq) for seq in sequences.values()], dtype=np.int64)
+    return ProteinSequences(PROTEIN_SEPARATOR.join(sequences.values()), list(sequences),
+                            csr_offsets(protein_lens + len(PROTEIN_SEPARATOR))[:-1], protein_lens)
+
+
+# Number of sets of FASTA files whose ProteinSequences read_protein_sequences keeps for later runs in the process
+LOADED_PROTEOMES: int = 4
+# ProteinSequences read by earlier runs in this process, most recently read last, keyed by the FASTA store directory
+# and the path, modification time and size of each fasta file
+loaded_protein_sequences: Dict[Tuple, ProteinSequences] = {}
+
+
+def read_protein_sequences(fasta_files: List[str], fasta_store_directory: str = '') -> ProteinSequences:
+    """
+    Gets the ProteinSequences of the fasta files, from a FASTA store when given a directory to keep FASTA stores in.
+    Sequences read by an earlier run in the same process are reused, along with their ProteinIndex once built, so a
+    batch of runs against the same fasta files only reads and indexes them once
+    :param fasta_files: the list of paths to fasta files to use in the alignment and localization
+    :param fasta_store_directory: the directory FASTA stores are kept in, empty to read the fasta files
+    :return: the ProteinSequences of the fasta files
+    """
+    key = (fasta_store_directory,) + tuple((os.path.abspath(file), os.stat(file).st_mtime_ns, os.stat(file).st_size)
+                                           for file in fasta_files)
+    protein_seq_records = loaded_protein_sequences.pop(key, None)
+    if protein_seq_records is None:
+        if fasta_store_directory:
+            protein_seq_records = load_protein_store(fasta_files, fasta_store_directory)
+        else:
+            protein_seq_records = get_protein_sequences(fasta_files)
+        while len(loaded_protein_sequences) >= LOADED_PROTEOMES:
+            loaded_protein_sequences.pop(next(iter(loaded_protein_sequences)))
+    loaded_protein_sequences[key] = protein_seq_records
+    return protein_seq_records
+
+
+def protein_store_directory(store_root: str, fasta_files: List[str]) -> str:
+    """
+    :return: the directory of the FASTA store of the fasta files under store_root. It is addressed by the contents of
+    the fasta files, so changing any of them gives a new store
+    """
+    key = json.dumps({'version': PROTEIN_STORE_VERSION, 'fasta': [file_digest(file) for file in fasta_files]})
+    return os.path.join(store_root, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def save_protein_store(store_directory: str, protein_seq_records: ProteinSequences, protein_index: ProteinIndex):
+    """
+    Saves the sequences and suffix array of a ProteinIndex as a FASTA store. The store is written under a temporary
+    name and renamed into place, so a store is either complete or missing
+    :param store_directory: the directory to save the store to, from protein_store_directory
+    :param protein_seq_records: the ProteinSequences the ProteinIndex was built from
+    :param protein_index: the ProteinIndex to save
+    """
+    partial_directory = store_directory + '.' + str(os.getpid()) + '.partial'
+    os.makedirs(partial_directory, exist_ok=True)
+    with open(os.path.join(partial_directory, 'sequence.bin'), 'wb') as outfile:
+        outfile.write(protein_index.Sequence)
+    suffix_array = protein_index.SuffixArray
+    if len(suffix_array) <= np.iinfo(np.int32).max:
+        suffix_array = suffix_array.astype(np.int32)  # halves the size of the store for all but the largest proteomes
+    np.save(os.path.join(partial_directory, 'suffix_array.npy'), suffix_array)
+    np.save(os.path.join(partial_directory, 'offsets.npy'), protein_index.ProteinOffsets)
+    np.save(os.path.join(partial_directory, 'lengths.npy'), protein_seq_records.protein_lens)
+    with open(os.path.join(partial_directory, 'protein_ids.json'), 'w') as outfile:
+        json.dump(protein_index.ProteinIDs, outfile)
+    try:
+        os.rename(partial_directory, store_directory)
+    except OSError:  # another run saved the same store first
+        shutil.rmtree(partial_directory, ignore_errors=True)
+
+
+def open_protein_store(store_directory: str) -> ProteinSequences:
+    """
+    Opens a FASTA store saved by save_protein_store. The sequences and suffix array are memory mapped rather than read
+    :param store_directory: the directory of the store
+    :return: the ProteinSequences of the store, with the suffix array of its ProteinIndex
+    """
+    with open(os.path.join(store_directory, 'protein_ids.json')) as infile:
+        protein_ids = json.load(infile)
+    with open(os.path.join(store_directory, 'sequence.bin'), 'rb') as infile:
+        # a file of no proteins is empty, which can't be memory mapped
+        sequence = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) if protein_ids else b''
+    return ProteinSequences(sequence, protein_ids, np.load(os.path.join(store_directory, 'offsets.npy')),
+                            np.load(os.path.join(store_directory, 'lengths.npy')),
+                            np.load(os.path.join(store_directory, 'suffix_array.npy'), mmap_mode='r'), store_directory)
+
+
+def load_protein_store(fasta_files: List[str], store_root: str) -> ProteinSequences:
+    """
+    Opens the FASTA store of the fasta files, building and saving it first if no earlier run has. Building the store
+    reads the fasta files and builds the ProteinIndex of their sequences, opening it does neither
+    :param fasta_files: the list of paths to fasta files to use in the alignment and localization
+    :param store_root: the directory FASTA stores are kept in
+    :return: the ProteinSequences of the store, with the suffix array of its ProteinIndex
+    """
+    store_directory = protein_store_directory(store_root, fasta_files)
+    if not os.path.isdir(store_directory):
+        protein_seq_records = get_protein_sequences(fasta_files)
+        save_protein_store(store_directory, protein_seq_records, build_protein_index(protein_seq_records))
+    return open_protein_store(store_directory)
+
+
+def build_protein_index(protein_seq_records: Mapping) -> ProteinIndex:
+    """
+    Builds a suffix array over all the protein sequences so that every occurrence of a peptide in every protein can
+    be found with a binary search instead of scanning each protein. The suffix array is sorted by prefix doubling
+    :param protein_seq_records: the ProteinSequences, or a dict of proteinID mapped to its sequence
+    :return: a ProteinIndex over the protein sequences. The suffix array is kept with the ProteinSequences, so they are
+    only indexed once, and ProteinSequences opened from a FASTA store are never indexed
+    """
+    if not isinstance(protein_seq_records, ProteinSequences):
+        protein_lens = np.array([len(seq) for seq in protein_seq_records.values()], dtype=np.int64)
+        protein_seq_records = ProteinSequences(
+            PROTEIN_SEPARATOR.join(bytes(seq).upper() for seq in protein_seq_records.values()),
+            list(protein_seq_records), csr_offsets(protein_lens + len(PROTEIN_SEPARATOR))[:-1], protein_lens)
+    sequence = protein_seq_records.sequence
+    protein_ids = protein_seq_records.protein_ids
+    protein_offsets = protein_seq_records.protein_offsets
+    if protein_seq_records.suffix_array is not None:
+        return ProteinIndex(Sequence=sequence, SuffixArray=protein_seq_records.suffix_array, ProteinIDs=protein_ids,
+                            ProteinOffsets=protein_offsets)
+
+    seq_len = len(sequence)
+    # rank of each suffix by its first character, ranks are kept dense so the highest rank is the number of distinct
+    # prefixes - 1
+    rank = np.unique(np.frombuffer(sequence, dtype=np.uint8), return_inverse=True)[1].astype(np.int64)
+    suffix_array = np.argsort(rank, kind='stable')
+    prefix_len = 1
+    # sort the suffixes by their first 2 * prefix_len characters using the ranks of their first prefix_len characters
+    # until every suffix has a distinct rank
+    while seq_len and rank.max() < seq_len - 1:
+        next_rank = np.full(seq_len, -1, dtype=np.int64)
+        next_rank[:seq_len - prefix_len] = rank[prefix_len:]
+        suffix_array = np.lexsort((next_rank, rank))
+        # suffixes get a new rank whenever either half of their sort key differs from the previous suffix
+        key_changes = (np.diff(rank[suffix_array]) != 0) | (np.diff(next_rank[suffix_array]) != 0)
+        rank = np.empty(seq_len, dtype=np.int64)
+        rank[suffix_array] = np.concatenate(([0], np.cumsum(key_changes)))
+        prefix_len *= 2
+
+    protein_seq_records.suffix_array = suffix_array
+    return ProteinIndex(Sequence=sequence, SuffixArray=suffix_array, ProteinIDs=protein_ids,
+                        ProteinOffsets=protein_offsets)
+
+
+def locate_peptides(protein_index: ProteinIndex, peptides) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Finds every occurrence of each peptide in every protein of a ProteinIndex
+    :param protein_index: the ProteinIndex to search
+    :param peptides: the peptide sequences to locate, each distinct sequence is only searched once
+    :return: a dict mapping each peptide to a dict of proteinID mapped to the zero indexed start of every occurrence of
+    the peptide in that protein, in ascending order. Proteins not containing the peptide are left out
+    """
+    sequence = protein_index.Sequence
+    suffix_array = protein_index.SuffixArray
+    peptide_occurrences = {}
+    for peptide in set(peptides):
+        pep_bytes = peptide.upper().encode('ascii')
+        if not pep_bytes:
+            peptide_occurrences[peptide] = {}
+            continue
+        # the suffixes starting with the peptide form one contiguous block of the suffix array
+        def suffix_prefix(pos):
+            return sequence[pos:pos + len(pep_bytes)]
+        first = bisect.bisect_left(suffix_array, pep_bytes, key=suffix_prefix)
+        last = bisect.bisect_right(suffix_array, pep_bytes, lo=first, key=suffix_prefix)
+        positions = np.sort(suffix_array[first:last])
+        # convert the positions in the concatenated sequence to positions in each protein
+        protein_nums = np.searchsorted(protein_index.ProteinOffsets, positions, side='right') - 1
+        occurrences = {}
+        for protein_num, position in zip(protein_nums.tolist(), positions.tolist()):
+            occurrences.setdefault(protein_index.ProteinIDs[protein_num], []).append(
+                position - int(protein_index.ProteinOffsets[protein_num]))
+        peptide_occurrences[peptide] = occurrences
+
+    return peptide_occurrences
+
+
+def output_residue_analysis_data(prot_id, fileid, abundance_array, output_directory, output_name_stub):
+    filename = output_directory + fileid + prot_id + output_name_stub + ".csv"
+    mod_props = modification_proportions(abundance_array[:, 0], abundance_array[:, 1])
+    with open(filename, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["Residue #:", "Modification Abundance", "Residue Abundance", "Modification Proportion"])
+        writer.writerows(zip(range(len(abundance_array)), abundance_array[:, 0].tolist(),
+                             abundance_array[:, 1].tolist(), mod_props.tolist()))
+    return
+
+
+def output_peptide_analysis_data(prot_id, file_id, fragment_list, output_directory, peptide_output_name_stub):
+    filename = output_directory + file_id + prot_id + peptide_output_name_stub + ".csv"
+    abundances = np.array([fragment[3:5] for fragment in fragment_list], dtype=float).reshape(-1, 2)
+    mod_props = modification_proportions(abundances[:, 0], abundances[:, 1])
+    with open(filename, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["Fragment", "Start Position", "End Position", "Length", "Phosphorylation Abundance",
+                         "Fragment Abundance", "Modification Proportion"])
+        writer.writerows(fragment[:5] + (mod_prop,) for fragment, mod_prop in zip(fragment_list, mod_props.tolist()))
     return
 
 
 if __name__ == '__main__':
     # execute only if run as a script
-    main()
+    arg_parser = argparse.ArgumentParser(description="Calculates residue and peptide modification abundances")
+    arg_parser.add_argument('configs', nargs='*', metavar='CONFIG',
+                            help="configuration files to run one after the other in this process, " + config_file +
+                                 " when neither these nor a manifest are given")
+    arg_parser.add_argument('--manifest', '-m', action='append', default=[],
+                            help="TOML manifest of jobs to run after the configuration files, each a [[job]] table of "
+                                 "the config file to run and the settings of it to override. May be given more than "
+                                 "once")
+    arg_parser.add_argument('--jobs', '-j', type=int, default=None,
+                            help="number of worker processes, overrides [execution] workers in the configuration")
+    arg_parser.add_argument('--profile', nargs='?', const='', default=None, metavar='REPORT',
+                            help="write the wall time, CPU time, peak memory and counts of each stage to the JSON file "
+                                 "REPORT, by default the [profile] report of the configuration")
+    arg_parser.add_argument('--keep-going', '-k', action='store_true',
+                            help="carry on with the remaining jobs when one fails, exiting with status 1 at the end")
+    args = arg_parser.parse_intermixed_args()
+    if not args.configs and not args.manifest:
+        args.configs = [config_file]
+    cli_batch = config_batch(args.configs)
+    for manifest_file in args.manifest:
+        cli_batch.extend(read_manifest(manifest_file))
+    if args.profile and len(cli_batch) > 1:
+        arg_parser.error("--profile REPORT would be overwritten by every job, give --profile without REPORT to write "
+                         "the report of each job to its configured report or output directory")
+    sys.exit(1 if run_batch(cli_batch, jobs=args.jobs, profile_report=args.profile, keep_going=args.keep_going) else 0)